@@ -3,111 +3,180 @@ import logging
 import os
 import sys
 from os import getenv
+from typing import Tuple
 
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
 from aiogram.fsm.storage.memory import MemoryStorage
 from dotenv import load_dotenv
 
-# Настройка логирования (нужно до загрузки env, чтобы логировать)
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+from services.health import create_health_server
+from services.sender import get_sender
+from services.usage_service import get_usage_ledger, init_usage_ledger
+from services.warmer import create_cache_warmer
+from utils.executors import shutdown_executors
+from utils.logging_setup import setup_logging
+from utils.loop_watchdog import create_loop_monitor
+from utils.middlewares import CancelGenerationMiddleware, CorrelationMiddleware, PollingMonitor
+
 logger = logging.getLogger(__name__)
 
-# Загружаем переменные окружения ПЕРЕД импортом handlers
-# Определяем путь к файлам относительно текущей директории скрипта
-script_dir = os.path.dirname(os.path.abspath(__file__))
-env_path = os.path.join(script_dir, '.env')
-env_example_path = os.path.join(script_dir, 'env.example')
-
-# Логирование путей только для отладки (можно убрать после проверки)
-# logger.info(f"Текущая рабочая директория: {os.getcwd()}")
-# logger.info(f"Директория скрипта: {script_dir}")
-# logger.info(f"Путь к .env: {env_path}")
-# logger.info(f"Файл .env существует: {os.path.exists(env_path)}")
-
-# Сначала пытаемся загрузить .env, если его нет - загружаем env.example
-if os.path.exists(env_path):
-    # Пробуем загрузить файл
-    try:
-        # Читаем файл вручную для отладки
-        with open(env_path, 'r', encoding='utf-8') as f:
-            file_content = f.read()
-            logger.info(f"Содержимое .env файла (первые 200 символов): {repr(file_content[:200])}")
-            logger.info(f"Длина файла: {len(file_content)} символов")
-            logger.info(f"Количество строк: {len(file_content.splitlines())}")
+
+def load_environment():
+    """
+    Загружает переменные окружения из .env (или env.example).
+
+    Модуль bot импортируется и в дочерних процессах (воркеры supervisor.py,
+    пул run_cpu_bound), поэтому при импорте он ничего не настраивает:
+    env, логирование и бота готовит точка входа.
+    """
+    # Временное логирование на время загрузки env; настоящее (с LOG_* из .env)
+    # включает configure_logging()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    # Определяем путь к файлам относительно текущей директории скрипта
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    env_path = os.path.join(script_dir, '.env')
+    env_example_path = os.path.join(script_dir, 'env.example')
+
+    # Логирование путей только для отладки (можно убрать после проверки)
+    # logger.info(f"Текущая рабочая директория: {os.getcwd()}")
+    # logger.info(f"Директория скрипта: {script_dir}")
+    # logger.info(f"Путь к .env: {env_path}")
+    # logger.info(f"Файл .env существует: {os.path.exists(env_path)}")
+
+    # Сначала пытаемся загрузить .env, если его нет - загружаем env.example
+    if os.path.exists(env_path):
+        # Пробуем загрузить файл
+        try:
+            # Читаем файл вручную для отладки
+            with open(env_path, 'r', encoding='utf-8') as f:
+                file_content = f.read()
+                logger.info(f"Содержимое .env файла (первые 200 символов): {repr(file_content[:200])}")
+                logger.info(f"Длина файла: {len(file_content)} символов")
+                logger.info(f"Количество строк: {len(file_content.splitlines())}")
         
-        # Загружаем через dotenv
-        result = load_dotenv(env_path, override=True)
-        logger.info(f"Результат load_dotenv: {result}")
+            # Загружаем через dotenv
+            result = load_dotenv(env_path, override=True)
+            logger.info(f"Результат load_dotenv: {result}")
         
-        # Проверяем что загрузилось
-        test_token = getenv("BOT_TOKEN")
-        logger.info(f"BOT_TOKEN после загрузки: {'найден' if test_token else 'НЕ найден'}")
-        if test_token:
-            logger.info(f"Длина токена: {len(test_token)} символов, начало: {test_token[:20]}...")
-        else:
-            # Пробуем загрузить вручную
-            logger.warning("Пробую загрузить переменные вручную...")
-            for line in file_content.split('\n'):
-                line = line.strip()
-                if '=' in line and not line.startswith('#'):
-                    key, value = line.split('=', 1)
-                    os.environ[key.strip()] = value.strip()
-                    logger.info(f"Установлена переменная: {key.strip()}")
+            # Проверяем что загрузилось
             test_token = getenv("BOT_TOKEN")
-            logger.info(f"BOT_TOKEN после ручной загрузки: {'найден' if test_token else 'НЕ найден'}")
-    except Exception as e:
-        logger.error(f"Ошибка при загрузке .env: {e}")
-        result = False
-elif os.path.exists(env_example_path):
-    load_dotenv(env_example_path)
-    logger.info("Используется env.example (файл .env не найден)")
-elif os.path.exists('.env'):
-    load_dotenv('.env')
-    logger.info("Загружен файл .env (относительный путь)")
-else:
-    load_dotenv()
-    logger.warning("Файлы .env и env.example не найдены, используются системные переменные окружения")
-
-# Импортируем handlers ПОСЛЕ загрузки переменных окружения
-from handlers import start, content, consult
-
-# Получаем токен бота
-BOT_TOKEN = getenv("BOT_TOKEN")
-if not BOT_TOKEN:
-    logger.error("BOT_TOKEN не найден в переменных окружения!")
-    logger.error("Создайте файл .env и добавьте туда ваш токен бота!")
-    sys.exit(1)
-
-# Проверяем, что токен не является плейсхолдером
-if BOT_TOKEN in ["your_bot_token_here", "your_bot_token", ""]:
-    logger.error("BOT_TOKEN содержит плейсхолдер, а не реальный токен!")
-    logger.error("Создайте файл .env на основе env.example и замените 'your_bot_token_here' на ваш реальный токен!")
-    logger.error("Получите токен у @BotFather в Telegram")
-    sys.exit(1)
-
-# Инициализация бота и диспетчера
-bot = Bot(token=BOT_TOKEN, parse_mode=ParseMode.HTML)
-dp = Dispatcher(storage=MemoryStorage())
+            logger.info(f"BOT_TOKEN после загрузки: {'найден' if test_token else 'НЕ найден'}")
+            if test_token:
+                logger.info(f"Длина токена: {len(test_token)} символов, начало: {test_token[:20]}...")
+            else:
+                # Пробуем загрузить вручную
+                logger.warning("Пробую загрузить переменные вручную...")
+                for line in file_content.split('\n'):
+                    line = line.strip()
+                    if '=' in line and not line.startswith('#'):
+                        key, value = line.split('=', 1)
+                        os.environ[key.strip()] = value.strip()
+                        logger.info(f"Установлена переменная: {key.strip()}")
+                test_token = getenv("BOT_TOKEN")
+                logger.info(f"BOT_TOKEN после ручной загрузки: {'найден' if test_token else 'НЕ найден'}")
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке .env: {e}")
+            result = False
+    elif os.path.exists(env_example_path):
+        load_dotenv(env_example_path)
+        logger.info("Используется env.example (файл .env не найден)")
+    elif os.path.exists('.env'):
+        load_dotenv('.env')
+        logger.info("Загружен файл .env (относительный путь)")
+    else:
+        load_dotenv()
+        logger.warning("Файлы .env и env.example не найдены, используются системные переменные окружения")
 
 
-async def main():
-    """Основная функция запуска бота"""
-    # Регистрируем роутеры
+def configure_logging():
+    """Настраивает логирование по LOG_* (после загрузки env)"""
+    # Запись в stdout и в logs/ идет из отдельного потока, а не из event loop
+    setup_logging(
+        level=os.getenv("LOG_LEVEL", "INFO"),
+        log_dir=os.getenv("LOG_DIR", "logs"),
+        log_file=os.getenv("LOG_FILE", "bot.log"),
+        log_format=os.getenv("LOG_FORMAT", "json")
+    )
+
+
+def create_bot() -> Tuple[Bot, Dispatcher, PollingMonitor]:
+    """Создает бота и диспетчер с middleware и роутерами"""
+    # Импортируем handlers ПОСЛЕ загрузки переменных окружения
+    from handlers import start, content, consult
+
+    # Получаем токен бота
+    BOT_TOKEN = getenv("BOT_TOKEN")
+    if not BOT_TOKEN:
+        logger.error("BOT_TOKEN не найден в переменных окружения!")
+        logger.error("Создайте файл .env и добавьте туда ваш токен бота!")
+        sys.exit(1)
+
+    # Проверяем, что токен не является плейсхолдером
+    if BOT_TOKEN in ["your_bot_token_here", "your_bot_token", ""]:
+        logger.error("BOT_TOKEN содержит плейсхолдер, а не реальный токен!")
+        logger.error("Создайте файл .env на основе env.example и замените 'your_bot_token_here' на ваш реальный токен!")
+        logger.error("Получите токен у @BotFather в Telegram")
+        sys.exit(1)
+
+    bot = Bot(token=BOT_TOKEN, parse_mode=ParseMode.HTML)
+    # Время последнего успешного getUpdates для проверок здоровья
+    polling_monitor = PollingMonitor()
+    bot.session.middleware(polling_monitor)
+    dp = Dispatcher(storage=MemoryStorage())
+    dp.update.outer_middleware(CorrelationMiddleware())
+    # Новая команда отменяет незавершенную генерацию в этом чате
+    dp.message.outer_middleware(CancelGenerationMiddleware())
+
     dp.include_router(start.router)
     dp.include_router(content.router)
     dp.include_router(consult.router)
+    return bot, dp, polling_monitor
+
+
+async def main():
+    """Основная функция запуска бота"""
+    bot, dp, polling_monitor = create_bot()
+    
+    # Журнал токенов читает базу при создании - делаем это до приема обновлений
+    await init_usage_ledger()
+    
+    # Фоновый прогрев популярных ответов в часы низкой нагрузки
+    warmer = create_cache_warmer()
+    warmer_task = asyncio.create_task(warmer.run()) if warmer else None
+    
+    # Задержка и блокировки event loop (работает и без сервера проверок здоровья)
+    loop_monitor = create_loop_monitor()
+    if loop_monitor:
+        loop_monitor.start()
+    
+    # Внутренний HTTP-сервер /health, /ready, /stats
+    health_server = create_health_server(polling_monitor, loop_monitor, bot)
+    if health_server:
+        await health_server.start()
     
     logger.info("Бот запущен и готов к работе!")
     
     # Запускаем polling
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        if warmer_task:
+            warmer_task.cancel()
+        if health_server:
+            await health_server.stop()
+        if loop_monitor:
+            loop_monitor.stop()
+        await get_sender().close()
+        # Дописываем накопленный журнал расхода токенов
+        await get_usage_ledger().close()
+        shutdown_executors()
 
 
 if __name__ == "__main__":
+    load_environment()
+    configure_logging()
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
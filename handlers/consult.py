@@ -4,23 +4,19 @@ from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
-from services.llm_service import LLMService
+from services.generation_tracker import GenerationCancelledError, get_generation_tracker
+from services.llm_service import get_llm_service
+from services.sender import get_sender
+from utils.formatting import prepare_llm_output
+from utils.input_filter import get_input_filter, read_user_input
 from utils.keyboards import (
     get_consultation_keyboard,
     get_main_keyboard,
     get_back_keyboard
 )
+from utils.prompts import CONSULT_TYPE_NAMES, CONSULT_EXAMPLES, build_consult_prompt
 
 router = Router()
-llm_service = None  # Инициализируется при первом использовании
-
-
-def get_llm_service():
-    """Получает или создает экземпляр LLMService"""
-    global llm_service
-    if llm_service is None:
-        llm_service = LLMService()
-    return llm_service
 
 
 class Consultation(StatesGroup):
@@ -34,7 +30,8 @@ class Consultation(StatesGroup):
 async def cmd_consult(message: Message, state: FSMContext):
     """Начало консультации"""
     await state.set_state(Consultation.waiting_for_type)
-    await message.answer(
+    await get_sender().answer(
+        message,
         "💼 <b>Консультация по вопросам бизнеса</b>\n\n"
         "Выберите тип консультации:",
         reply_markup=get_consultation_keyboard()
@@ -45,28 +42,19 @@ async def cmd_consult(message: Message, state: FSMContext):
 async def process_consult_type(callback: CallbackQuery, state: FSMContext):
     """Обработка выбора типа консультации"""
     consult_type = callback.data.replace("consult_", "")
-    type_names = {
-        "legal": "Юридические вопросы",
-        "marketing": "Маркетинг",
-        "finance": "Финансы",
-        "other": "Другие вопросы"
-    }
-    type_name = type_names.get(consult_type, "Общие вопросы")
+    type_name = CONSULT_TYPE_NAMES.get(consult_type, "Общие вопросы")
     
     await state.update_data(consult_type=consult_type)
     await state.set_state(Consultation.waiting_for_question)
     
-    examples = {
-        "legal": "Например: какие документы нужны для регистрации ИП?",
-        "marketing": "Например: как продвигать бизнес в Instagram?",
-        "finance": "Например: как вести учет доходов и расходов?",
-        "other": "Например: как выбрать нишу для бизнеса?"
-    }
+    example = CONSULT_EXAMPLES.get(consult_type)
+    example_text = f"Например: {example}" if example else ""
     
-    await callback.message.edit_text(
+    await get_sender().edit_text(
+        callback.message,
         f"💼 <b>{type_name}</b>\n\n"
         f"Опишите ваш вопрос подробно:\n"
-        f"{examples.get(consult_type, '')}\n\n"
+        f"{example_text}\n\n"
         f"Чем больше деталей вы укажете, тем точнее будет ответ.",
         reply_markup=get_back_keyboard()
     )
@@ -76,48 +64,47 @@ async def process_consult_type(callback: CallbackQuery, state: FSMContext):
 @router.message(Consultation.waiting_for_question)
 async def process_question(message: Message, state: FSMContext):
     """Обработка вопроса и генерация ответа"""
+    question = await read_user_input(message)
+    if question is None:
+        return
+    
     data = await state.get_data()
     consult_type = data.get("consult_type", "other")
     
-    type_contexts = {
-        "legal": "юридическим вопросам для малого бизнеса в России",
-        "marketing": "маркетингу и продвижению малого бизнеса",
-        "finance": "финансовым вопросам и учету для малого бизнеса",
-        "other": "общим вопросам ведения малого бизнеса"
-    }
-    
-    context = type_contexts.get(consult_type, "общим вопросам бизнеса")
+    await get_sender().answer(message, "⏳ Анализирую ваш вопрос и готовлю ответ...")
     
-    await message.answer("⏳ Анализирую ваш вопрос и готовлю ответ...")
-    
-    prompt = (
-        f"Ты - эксперт по {context}. "
-        f"Ответь на вопрос владельца малого бизнеса:\n\n"
-        f"{message.text}\n\n"
-        f"Требования к ответу:\n"
-        f"- Будь конкретным и практичным\n"
-        f"- Приведи примеры, если возможно\n"
-        f"- Структурируй ответ (используй списки, если уместно)\n"
-        f"- Укажи на важные нюансы и подводные камни\n"
-        f"- Если вопрос требует юридической консультации, укажи, что лучше обратиться к юристу\n"
-        f"- Длина: 200-400 слов"
-    )
+    prompt = build_consult_prompt(consult_type, question)
     
     try:
-        answer = await get_llm_service().generate_text(prompt)
-        await message.answer(
+        answer = await get_generation_tracker().run(
+            message.chat.id,
+            get_llm_service().generate_text(
+                prompt,
+                user_id=message.from_user.id,
+                chat_id=message.chat.id,
+                content_type=f"consult_{consult_type}"
+            )
+        )
+        answer = await prepare_llm_output(answer)
+        await get_sender().answer(
+            message,
             f"💡 <b>Ответ на ваш вопрос:</b>\n\n"
             f"{answer}\n\n"
             f"⚠️ <i>Важно: Это общие рекомендации. "
             f"Для сложных вопросов рекомендуется консультация со специалистом.</i>",
             reply_markup=get_main_keyboard()
         )
+    except GenerationCancelledError:
+        return
     except Exception as e:
-        await message.answer(
+        await get_sender().answer(
+            message,
             f"❌ Произошла ошибка: {str(e)}\n"
             f"Попробуйте переформулировать вопрос или обратитесь в поддержку.",
             reply_markup=get_main_keyboard()
         )
+    finally:
+        get_input_filter().forget(message.chat.id)
     
     await state.clear()
 
@@ -125,18 +112,22 @@ async def process_question(message: Message, state: FSMContext):
 @router.callback_query(F.data == "back")
 async def back_to_main_consult(callback: CallbackQuery, state: FSMContext):
     """Возврат в главное меню из консультаций"""
+    get_generation_tracker().cancel(callback.message.chat.id)
     await state.clear()
     try:
-        await callback.message.edit_text(
+        await get_sender().edit_text(
+            callback.message,
             "👋 <b>Главное меню</b>\n\nВыберите, что вам нужно:",
             reply_markup=None
         )
-        await callback.message.answer(
+        await get_sender().answer(
+            callback.message,
             "Выберите действие:",
             reply_markup=get_main_keyboard()
         )
     except Exception:
-        await callback.message.answer(
+        await get_sender().answer(
+            callback.message,
             "👋 <b>Главное меню</b>\n\nВыберите, что вам нужно:",
             reply_markup=get_main_keyboard()
         )
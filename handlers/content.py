@@ -1,27 +1,64 @@
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from typing import Tuple
+
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery
+from aiogram.types import Message, CallbackQuery, FSInputFile
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
-from services.llm_service import LLMService
+from services.export import EXPORT_FORMATS, export_documents
+from services.generation_tracker import GenerationCancelledError, get_generation_tracker
+from services.llm_service import get_llm_service
+from services.sender import PRIORITY_BULK, get_sender
+from utils.formatting import prepare_llm_output
+from utils.input_filter import get_input_filter, read_user_input
 from utils.keyboards import (
     get_content_type_keyboard,
     get_platform_keyboard,
+    get_multi_platform_keyboard,
     get_main_keyboard,
-    get_back_keyboard
+    get_back_keyboard,
+    get_export_keyboard
+)
+from utils.prompts import (
+    PLATFORM_NAMES,
+    build_post_prompt,
+    build_multi_post_prompt,
+    build_offer_prompt,
+    build_product_prompt
 )
 
+logger = logging.getLogger(__name__)
+
 router = Router()
-llm_service = None  # Инициализируется при первом использовании
+
+POST_PARAMS_HINT = (
+    "Опишите, о чем должен быть пост:\n"
+    "• Тема/повод\n"
+    "• Ключевые моменты\n"
+    "• Целевая аудитория\n"
+    "• Желаемый тон (формальный/неформальный)\n\n"
+    "💡 <b>Пример:</b> Анонс новой коллекции одежды для молодежи, "
+    "неформальный тон, акцент на стиль и доступность"
+)
 
 
-def get_llm_service():
-    """Получает или создает экземпляр LLMService"""
-    global llm_service
-    if llm_service is None:
-        llm_service = LLMService()
-    return llm_service
+# Тексты под кнопками выгрузки: (chat_id, message_id) -> (заголовок, текст).
+# Кнопки есть под каждым КП и описанием, поэтому текст ищем по сообщению,
+# а не храним один на чат. Самые старые записи вытесняются
+EXPORT_TEXTS_LIMIT = 1000
+_export_texts: "OrderedDict[Tuple[int, int], Tuple[str, str]]" = OrderedDict()
+
+
+def remember_export(message: Message, title: str, text: str):
+    """Запоминает текст для кнопок выгрузки под отправленным сообщением"""
+    _export_texts[(message.chat.id, message.message_id)] = (title, text)
+    while len(_export_texts) > EXPORT_TEXTS_LIMIT:
+        _export_texts.popitem(last=False)
 
 
 class ContentGeneration(StatesGroup):
@@ -39,7 +76,8 @@ class ContentGeneration(StatesGroup):
 async def cmd_post(message: Message, state: FSMContext):
     """Начало создания поста для соцсетей"""
     await state.set_state(ContentGeneration.waiting_for_platform)
-    await message.answer(
+    await get_sender().answer(
+        message,
         "🎯 <b>Создание поста для социальных сетей</b>\n\n"
         "Выберите платформу:",
         reply_markup=get_platform_keyboard()
@@ -50,27 +88,75 @@ async def cmd_post(message: Message, state: FSMContext):
 async def process_platform(callback: CallbackQuery, state: FSMContext):
     """Обработка выбора платформы"""
     platform = callback.data.replace("platform_", "")
-    platform_names = {
-        "instagram": "Instagram",
-        "vk": "ВКонтакте",
-        "telegram": "Telegram",
-        "facebook": "Facebook",
-        "ok": "Одноклассники"
-    }
-    platform_name = platform_names.get(platform, platform)
+    platform_name = PLATFORM_NAMES.get(platform, platform)
     
-    await state.update_data(platform=platform, content_type="post")
+    await state.update_data(platform=platform, platforms=None, content_type="post")
     await state.set_state(ContentGeneration.waiting_for_post_params)
     
-    await callback.message.edit_text(
+    await get_sender().edit_text(
+        callback.message,
         f"📱 <b>Создание поста для {platform_name}</b>\n\n"
-        "Опишите, о чем должен быть пост:\n"
-        "• Тема/повод\n"
-        "• Ключевые моменты\n"
-        "• Целевая аудитория\n"
-        "• Желаемый тон (формальный/неформальный)\n\n"
-        "💡 <b>Пример:</b> Анонс новой коллекции одежды для молодежи, "
-        "неформальный тон, акцент на стиль и доступность",
+        f"{POST_PARAMS_HINT}",
+        reply_markup=get_back_keyboard()
+    )
+    await callback.answer()
+
+
+@router.callback_query(F.data == "platforms_multi")
+async def process_multi_platform(callback: CallbackQuery, state: FSMContext):
+    """Переход к выбору нескольких платформ"""
+    await state.update_data(platforms=[])
+    await state.set_state(ContentGeneration.waiting_for_platform)
+    await get_sender().edit_text(
+        callback.message,
+        "🌐 <b>Пост сразу для нескольких платформ</b>\n\n"
+        "Отметьте площадки и нажмите «Готово»:",
+        reply_markup=get_multi_platform_keyboard()
+    )
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("toggle_platform_"))
+async def toggle_platform(callback: CallbackQuery, state: FSMContext):
+    """Переключение платформы в мультивыборе"""
+    platform = callback.data.replace("toggle_platform_", "")
+    data = await state.get_data()
+    selected = list(data.get("platforms") or [])
+    
+    if platform == "all":
+        selected = [] if len(selected) == len(PLATFORM_NAMES) else list(PLATFORM_NAMES)
+    elif platform in selected:
+        selected.remove(platform)
+    elif platform in PLATFORM_NAMES:
+        selected.append(platform)
+    
+    await state.update_data(platforms=selected)
+    await get_sender().edit_reply_markup(
+        callback.message,
+        reply_markup=get_multi_platform_keyboard(selected)
+    )
+    await callback.answer()
+
+
+@router.callback_query(F.data == "platforms_done")
+async def process_platforms_done(callback: CallbackQuery, state: FSMContext):
+    """Завершение мультивыбора платформ"""
+    data = await state.get_data()
+    selected = data.get("platforms") or []
+    if not selected:
+        await callback.answer("Выберите хотя бы одну платформу", show_alert=True)
+        return
+    
+    # Сохраняем порядок как на клавиатуре
+    selected = [platform for platform in PLATFORM_NAMES if platform in selected]
+    await state.update_data(platform=selected[0], platforms=selected, content_type="post")
+    await state.set_state(ContentGeneration.waiting_for_post_params)
+    
+    names = ", ".join(PLATFORM_NAMES[platform] for platform in selected)
+    await get_sender().edit_text(
+        callback.message,
+        f"📱 <b>Создание постов для: {names}</b>\n\n"
+        f"{POST_PARAMS_HINT}",
         reply_markup=get_back_keyboard()
     )
     await callback.answer()
@@ -79,46 +165,157 @@ async def process_platform(callback: CallbackQuery, state: FSMContext):
 @router.message(ContentGeneration.waiting_for_post_params)
 async def generate_post(message: Message, state: FSMContext):
     """Генерация поста на основе параметров"""
+    description = await read_user_input(message)
+    if description is None:
+        return
+    
     data = await state.get_data()
     platform = data.get("platform", "социальных сетей")
+    platforms = data.get("platforms") or []
     
-    await message.answer("⏳ Генерирую пост... Это займет несколько секунд.")
-    
-    prompt = (
-        f"Создай пост для {platform} на основе следующего описания:\n\n"
-        f"{message.text}\n\n"
-        f"Требования:\n"
-        f"- Адаптируй стиль под {platform}\n"
-        f"- Используй эмодзи уместно\n"
-        f"- Сделай текст привлекательным и вовлекающим\n"
-        f"- Добавь призыв к действию\n"
-        f"- Длина: 1-2 абзаца для {platform}"
-    )
+    if len(platforms) > 1:
+        try:
+            await get_generation_tracker().run(
+                message.chat.id, generate_multi_platform_posts(message, platforms, description)
+            )
+        except GenerationCancelledError:
+            # Пользователь уже ушел в другое меню, состояние не трогаем
+            return
+        finally:
+            get_input_filter().forget(message.chat.id)
+        await state.clear()
+        return
+    
+    await get_sender().answer(message, "⏳ Генерирую пост... Это займет несколько секунд.")
+    
+    prompt = build_post_prompt(platform, description)
     
     try:
-        generated_text = await get_llm_service().generate_text(prompt)
-        await message.answer(
+        generated_text = await get_generation_tracker().run(
+            message.chat.id,
+            get_llm_service().generate_text(
+                prompt,
+                user_id=message.from_user.id,
+                chat_id=message.chat.id,
+                content_type="post"
+            )
+        )
+        generated_text = await prepare_llm_output(generated_text)
+        await get_sender().answer(
+            message,
             f"✅ <b>Готовый пост для {platform}:</b>\n\n"
             f"{generated_text}\n\n"
             "📋 Скопируйте текст выше",
             reply_markup=get_main_keyboard()
         )
+    except GenerationCancelledError:
+        return
     except Exception as e:
-        await message.answer(
+        await get_sender().answer(
+            message,
             f"❌ Произошла ошибка при генерации: {str(e)}\n"
             "Попробуйте еще раз или обратитесь в поддержку.",
             reply_markup=get_main_keyboard()
         )
+    finally:
+        get_input_filter().forget(message.chat.id)
     
     await state.clear()
 
 
+async def generate_multi_platform_posts(message: Message, platforms: list, description: str):
+    """
+    Генерация постов сразу для нескольких платформ.
+    
+    Если провайдер умеет отвечать JSON и включен режим MULTI_PLATFORM_MODE=json,
+    делаем один запрос на все платформы. Иначе (или для платформ, которых не
+    оказалось в ответе) запросы идут параллельно, а посты отправляются по мере
+    готовности.
+    """
+    llm = get_llm_service()
+    usage = {
+        "user_id": message.from_user.id,
+        "chat_id": message.chat.id,
+        "content_type": "post",
+        # Один срок на все посты: эскалации и повторы не продлевают ожидание
+        "deadline": llm.make_deadline()
+    }
+    
+    await get_sender().answer(
+        message,
+        f"⏳ Генерирую посты для {len(platforms)} платформ... Это займет несколько секунд."
+    )
+    
+    remaining = list(platforms)
+    if os.getenv("MULTI_PLATFORM_MODE", "parallel") == "json" and llm.supports_json_output:
+        try:
+            posts = await llm.generate_json(
+                build_multi_post_prompt(platforms, description), **usage
+            )
+        except Exception as e:
+            logger.warning(f"Не удалось получить посты одним JSON-ответом: {e}")
+            posts = {}
+        for platform in platforms:
+            text = posts.get(platform)
+            if isinstance(text, str) and text.strip():
+                remaining.remove(platform)
+                await send_platform_post(message, platform, text.strip())
+    
+    async def generate_for(platform: str):
+        text = await llm.generate_text(build_post_prompt(platform, description), **usage)
+        return platform, text
+    
+    tasks = [asyncio.create_task(generate_for(platform)) for platform in remaining]
+    failed = []
+    try:
+        for future in asyncio.as_completed(tasks):
+            try:
+                platform, text = await future
+            except Exception as e:
+                failed.append(str(e))
+                continue
+            await send_platform_post(message, platform, text)
+    finally:
+        for task in tasks:
+            task.cancel()
+    
+    # Итог - тоже с PRIORITY_BULK, чтобы не обогнать посты в очереди отправки
+    if failed:
+        await get_sender().answer(
+            message,
+            f"❌ Не удалось сгенерировать {len(failed)} из {len(platforms)} постов: {failed[0]}\n"
+            "Попробуйте еще раз или обратитесь в поддержку.",
+            reply_markup=get_main_keyboard(),
+            priority=PRIORITY_BULK
+        )
+    else:
+        await get_sender().answer(
+            message,
+            "📋 Все посты готовы, скопируйте тексты выше",
+            reply_markup=get_main_keyboard(),
+            priority=PRIORITY_BULK
+        )
+
+
+async def send_platform_post(message: Message, platform: str, text: str):
+    """Отправляет готовый пост для одной платформы"""
+    text = await prepare_llm_output(text)
+    # Пачка постов не должна задерживать интерактивные ответы другим пользователям
+    await get_sender().answer(
+        message,
+        f"✅ <b>Готовый пост для {PLATFORM_NAMES.get(platform, platform)}:</b>\n\n"
+        f"{text}",
+        priority=PRIORITY_BULK
+    )
+
+
 @router.message(Command("offer"))
 @router.message(F.text == "📝 Коммерческое предложение")
 async def cmd_offer(message: Message, state: FSMContext):
     """Начало создания коммерческого предложения"""
     await state.set_state(ContentGeneration.waiting_for_offer_params)
-    await message.answer(
+    await get_sender().answer(
+        message,
         "📝 <b>Создание коммерческого предложения</b>\n\n"
         "Опишите детали вашего предложения:\n"
         "• Название компании/продукта\n"
@@ -135,34 +332,43 @@ async def cmd_offer(message: Message, state: FSMContext):
 @router.message(ContentGeneration.waiting_for_offer_params)
 async def generate_offer(message: Message, state: FSMContext):
     """Генерация коммерческого предложения"""
-    await message.answer("⏳ Составляю коммерческое предложение...")
-    
-    prompt = (
-        f"Создай профессиональное коммерческое предложение на основе следующего описания:\n\n"
-        f"{message.text}\n\n"
-        f"Структура КП:\n"
-        f"1. Приветствие и представление\n"
-        f"2. Описание проблемы клиента\n"
-        f"3. Предложение решения\n"
-        f"4. Преимущества и выгоды\n"
-        f"5. Призыв к действию\n"
-        f"6. Контакты\n\n"
-        f"Стиль: профессиональный, убедительный, но не навязчивый"
-    )
+    description = await read_user_input(message)
+    if description is None:
+        return
+    
+    await get_sender().answer(message, "⏳ Составляю коммерческое предложение...")
+    
+    prompt = build_offer_prompt(description)
     
     try:
-        generated_text = await get_llm_service().generate_text(prompt)
-        await message.answer(
+        generated_text = await get_generation_tracker().run(
+            message.chat.id,
+            get_llm_service().generate_text(
+                prompt,
+                user_id=message.from_user.id,
+                chat_id=message.chat.id,
+                content_type="offer"
+            )
+        )
+        generated_text = await prepare_llm_output(generated_text)
+        sent = await get_sender().answer(
+            message,
             f"✅ <b>Готовое коммерческое предложение:</b>\n\n"
             f"{generated_text}\n\n"
-            "📋 Скопируйте текст выше",
-            reply_markup=get_main_keyboard()
+            "📋 Скопируйте текст выше или скачайте его документом",
+            reply_markup=get_export_keyboard()
         )
+        remember_export(sent, "Коммерческое предложение", generated_text)
+    except GenerationCancelledError:
+        return
     except Exception as e:
-        await message.answer(
+        await get_sender().answer(
+            message,
             f"❌ Произошла ошибка: {str(e)}",
             reply_markup=get_main_keyboard()
         )
+    finally:
+        get_input_filter().forget(message.chat.id)
     
     await state.clear()
 
@@ -172,7 +378,8 @@ async def generate_offer(message: Message, state: FSMContext):
 async def cmd_product(message: Message, state: FSMContext):
     """Начало создания описания товара/услуги"""
     await state.set_state(ContentGeneration.waiting_for_product_params)
-    await message.answer(
+    await get_sender().answer(
+        message,
         "🛍️ <b>Создание описания товара или услуги</b>\n\n"
         "Опишите ваш товар или услугу:\n"
         "• Название\n"
@@ -189,54 +396,102 @@ async def cmd_product(message: Message, state: FSMContext):
 @router.message(ContentGeneration.waiting_for_product_params)
 async def generate_product(message: Message, state: FSMContext):
     """Генерация описания товара/услуги"""
-    await message.answer("⏳ Создаю описание...")
-    
-    prompt = (
-        f"Создай привлекательное описание товара/услуги на основе следующего:\n\n"
-        f"{message.text}\n\n"
-        f"Требования:\n"
-        f"- Заголовок, привлекающий внимание\n"
-        f"- Структурированное описание с преимуществами\n"
-        f"- Использование маркированных списков\n"
-        f"- Призыв к действию\n"
-        f"- SEO-оптимизация (если применимо)\n"
-        f"- Длина: 150-300 слов"
-    )
+    description = await read_user_input(message)
+    if description is None:
+        return
+    
+    await get_sender().answer(message, "⏳ Создаю описание...")
+    
+    prompt = build_product_prompt(description)
     
     try:
-        generated_text = await get_llm_service().generate_text(prompt)
-        await message.answer(
+        generated_text = await get_generation_tracker().run(
+            message.chat.id,
+            get_llm_service().generate_text(
+                prompt,
+                user_id=message.from_user.id,
+                chat_id=message.chat.id,
+                content_type="product"
+            )
+        )
+        generated_text = await prepare_llm_output(generated_text)
+        sent = await get_sender().answer(
+            message,
             f"✅ <b>Готовое описание:</b>\n\n"
             f"{generated_text}\n\n"
-            "📋 Скопируйте текст выше",
-            reply_markup=get_main_keyboard()
+            "📋 Скопируйте текст выше или скачайте его документом",
+            reply_markup=get_export_keyboard()
         )
+        remember_export(sent, "Описание товара или услуги", generated_text)
+    except GenerationCancelledError:
+        return
     except Exception as e:
-        await message.answer(
+        await get_sender().answer(
+            message,
             f"❌ Произошла ошибка: {str(e)}",
             reply_markup=get_main_keyboard()
         )
+    finally:
+        get_input_filter().forget(message.chat.id)
     
     await state.clear()
 
 
+@router.callback_query(F.data.startswith("export_"))
+async def export_content(callback: CallbackQuery, state: FSMContext):
+    """Выгрузка текста из сообщения, под которым нажата кнопка, файлом"""
+    fmt = callback.data.replace("export_", "")
+    export = _export_texts.get((callback.message.chat.id, callback.message.message_id))
+    if fmt not in EXPORT_FORMATS or export is None:
+        await callback.answer(
+            "Текст для выгрузки больше недоступен, сгенерируйте его заново",
+            show_alert=True
+        )
+        return
+    
+    await callback.answer(f"Готовлю {EXPORT_FORMATS[fmt]}...")
+    title, text = export
+    path = None
+    try:
+        path = await export_documents(fmt, [(title, text)])
+        document = FSInputFile(path, filename=f"{title}.{fmt}")
+        await get_sender().send(
+            callback.message.chat.id,
+            lambda: callback.message.answer_document(document, reply_markup=get_main_keyboard())
+        )
+    except Exception as e:
+        logger.error(f"Ошибка выгрузки в {fmt}: {e}")
+        await get_sender().answer(
+            callback.message,
+            f"❌ Не удалось подготовить файл: {str(e)}",
+            reply_markup=get_main_keyboard()
+        )
+    finally:
+        if path:
+            os.remove(path)
+
+
 @router.callback_query(F.data == "back")
 async def back_to_main(callback: CallbackQuery, state: FSMContext):
     """Возврат в главное меню"""
+    get_generation_tracker().cancel(callback.message.chat.id)
     await state.clear()
     try:
         # Пытаемся отредактировать сообщение с inline-кнопками
-        await callback.message.edit_text(
+        await get_sender().edit_text(
+            callback.message,
             "👋 <b>Главное меню</b>\n\nВыберите, что вам нужно:",
             reply_markup=None
         )
-        await callback.message.answer(
+        await get_sender().answer(
+            callback.message,
             "Выберите действие:",
             reply_markup=get_main_keyboard()
         )
     except Exception:
         # Если не удалось отредактировать, отправляем новое сообщение
-        await callback.message.answer(
+        await get_sender().answer(
+            callback.message,
             "👋 <b>Главное меню</b>\n\nВыберите, что вам нужно:",
             reply_markup=get_main_keyboard()
         )
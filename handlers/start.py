@@ -2,6 +2,7 @@ from aiogram import Router, F
 from aiogram.types import Message
 from aiogram.filters import Command
 
+from services.sender import get_sender
 from utils.keyboards import get_main_keyboard
 
 router = Router()
@@ -20,7 +21,8 @@ async def cmd_start(message: Message):
         "💼 <b>Консультации</b> - юридические, маркетинговые, финансовые\n\n"
         "Выберите, что вам нужно:"
     )
-    await message.answer(
+    await get_sender().answer(
+        message,
         welcome_text,
         reply_markup=get_main_keyboard()
     )
@@ -45,5 +47,5 @@ async def cmd_help(message: Message):
         "3. Получите готовый контент для копирования\n\n"
         "💡 <b>Совет:</b> Чем подробнее вы опишете задачу, тем лучше будет результат!"
     )
-    await message.answer(help_text, reply_markup=get_main_keyboard())
+    await get_sender().answer(message, help_text, reply_markup=get_main_keyboard())
 
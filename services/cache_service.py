@@ -0,0 +1,203 @@
+import hashlib
+import os
+import re
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from utils.executors import run_blocking
+
+
+class ResponseCache:
+    """
+    Кэш ответов LLM по нормализованному промпту.
+
+    Кроме самих ответов, запоминает частоту запросов, чтобы фоновый
+    прогрев мог заранее обновлять самые популярные из них.
+
+    Если задан db_path, ответы дополнительно хранятся в SQLite, и кэш
+    становится общим для нескольких процессов бота (см. supervisor.py).
+    """
+
+    def __init__(
+        self,
+        ttl: int = 43200,
+        max_entries: int = 1000,
+        popularity_window: int = 7 * 86400,
+        db_path: Optional[str] = None
+    ):
+        # ttl = 0 - кэш выключен
+        self.ttl = ttl
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.popularity_window = popularity_window
+        self.hits = 0
+        self.misses = 0
+        # ключ -> (время истечения, текст)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        # ключ -> {"prompt", "max_tokens", "temperature", "count", "last_seen"}
+        self._requests: Dict[str, dict] = {}
+
+        if self.db_path and self.enabled:
+            self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    def _init_db(self):
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, expires_at REAL NOT NULL, text TEXT NOT NULL)"
+            )
+        conn.close()
+
+    def _db_get(self, key: str) -> Optional[tuple]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT expires_at, text FROM responses WHERE key = ? AND expires_at > ?",
+                (key, time.time())
+            ).fetchone()
+        conn.close()
+        return row
+
+    def _db_set(self, key: str, expires_at: float, text: str):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, expires_at, text) VALUES (?, ?, ?)",
+                (key, expires_at, text)
+            )
+            conn.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+        conn.close()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    @staticmethod
+    def normalize(prompt: str) -> str:
+        """Приводит промпт к виду, не зависящему от регистра и пробелов"""
+        return re.sub(r"\s+", " ", prompt).strip().lower()
+
+    def make_key(
+        self,
+        provider: str,
+        model: str,
+        prompt: str,
+        max_tokens: int,
+        temperature: float
+    ) -> str:
+        raw = f"{provider}\n{model}\n{max_tokens}\n{temperature}\n{self.normalize(prompt)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Возвращает ответ из кэша или None"""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.time():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: str, text: str):
+        """Сохраняет ответ, вытесняя самые давние записи"""
+        if not self.enabled:
+            return
+        self._entries[key] = (time.time() + self.ttl, text)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def aget(self, key: str) -> Optional[str]:
+        """Как get, но при промахе заглядывает в общий SQLite-кэш"""
+        text = self.get(key)
+        if text is not None or not self.db_path or not self.enabled:
+            return text
+        row = await run_blocking(self._db_get, key)
+        if row is None:
+            return None
+        # Промах в памяти уже посчитан в get, засчитываем как попадание
+        self.misses -= 1
+        self.hits += 1
+        self._entries[key] = row
+        return row[1]
+
+    async def aset(self, key: str, text: str):
+        """Как set, но дополнительно пишет ответ в общий SQLite-кэш"""
+        self.set(key, text)
+        if self.db_path and self.enabled:
+            await run_blocking(self._db_set, key, self._entries[key][0], text)
+
+    def ttl_left(self, key: str) -> float:
+        """Сколько секунд осталось жить записи (0, если ее нет)"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return 0
+        return max(0.0, entry[0] - time.time())
+
+    def note_request(self, key: str, prompt: str, max_tokens: int, temperature: float):
+        """Учитывает запрос в статистике популярности"""
+        now = time.time()
+        stats = self._requests.get(key)
+        if stats is None:
+            if len(self._requests) >= self.max_entries * 2:
+                self._evict_unpopular(now)
+            stats = self._requests[key] = {
+                "prompt": prompt,
+                "max_tokens": max_tokens,
+                "temperature": temperature,
+                "count": 0
+            }
+        stats["count"] += 1
+        stats["last_seen"] = now
+
+    def _evict_unpopular(self, now: float):
+        """Удаляет устаревшие и самые редкие запросы из статистики"""
+        oldest = now - self.popularity_window
+        for key in [k for k, v in self._requests.items() if v["last_seen"] < oldest]:
+            del self._requests[key]
+        if len(self._requests) >= self.max_entries * 2:
+            rare = sorted(self._requests, key=lambda k: self._requests[k]["count"])
+            for key in rare[:len(rare) // 2]:
+                del self._requests[key]
+
+    def top_requests(self, limit: int, min_count: int = 2) -> List[dict]:
+        """Самые частые запросы за окно популярности (с ключом кэша)"""
+        oldest = time.time() - self.popularity_window
+        candidates = [
+            dict(stats, key=key)
+            for key, stats in self._requests.items()
+            if stats["count"] >= min_count and stats["last_seen"] >= oldest
+        ]
+        candidates.sort(key=lambda stats: stats["count"], reverse=True)
+        return candidates[:limit]
+
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+response_cache = None  # Инициализируется при первом использовании
+
+
+def get_response_cache() -> ResponseCache:
+    """Получает или создает общий экземпляр ResponseCache"""
+    global response_cache
+    if response_cache is None:
+        # По умолчанию кэш нужен только прогреву: без него повторный запрос
+        # пользователя должен давать новый вариант текста, а не прежний ответ
+        warmer_enabled = os.getenv("WARMER_ENABLED", "false").lower() in ("1", "true", "yes")
+        response_cache = ResponseCache(
+            ttl=int(os.getenv("RESPONSE_CACHE_TTL") or ("43200" if warmer_enabled else "0")),
+            max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", "1000")),
+            db_path=os.getenv("RESPONSE_CACHE_PATH") or None
+        )
+    return response_cache
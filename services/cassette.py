@@ -0,0 +1,234 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import aiohttp
+
+from utils.executors import run_blocking
+
+logger = logging.getLogger(__name__)
+
+CASSETTE_MODES = ("record", "replay", "synthetic")
+
+
+def redact_url(url: str) -> str:
+    """Убирает API-ключ из адреса запроса (Gemini передает его в ?key=)"""
+    return re.sub(r"([?&]key=)[^&]+", r"\1REDACTED", url)
+
+
+def make_request_key(method: str, url: str, payload: Any) -> str:
+    """Ключ записи: метод, адрес без ключей и тело запроса"""
+    body = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    raw = f"{method}\n{redact_url(url)}\n{body}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class CassetteResponse:
+    """Ответ из кассеты с тем же интерфейсом, что и aiohttp.ClientResponse"""
+
+    def __init__(self, status: int, body: str):
+        self.status = status
+        self._body = body
+
+    async def text(self) -> str:
+        return self._body
+
+    async def json(self) -> Any:
+        return json.loads(self._body)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+
+class _CassetteRequest:
+    """Позволяет писать `async with session.post(...) as response`"""
+
+    def __init__(self, coro):
+        self._coro = coro
+
+    async def __aenter__(self) -> CassetteResponse:
+        return await self._coro
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+
+class CassetteSession:
+    """
+    Подмена aiohttp-сессии для LLMService.
+
+    Режимы:
+        record - выполняет настоящие запросы и дописывает обмены в кассету
+            (ключи API в файл не попадают);
+        replay - отвечает из кассеты, при желании выдерживая записанное время;
+        synthetic - генерирует ответ нужного провайдеру формата заданной
+            длины с заданной задержкой, без сети и без кассеты.
+
+    Кассета - файл JSON Lines в gzip, по одной записи на обмен.
+    """
+
+    def __init__(
+        self,
+        mode: str,
+        path: str,
+        replay_timing: bool = False,
+        synthetic_tokens: int = 200,
+        synthetic_latency: float = 1.0
+    ):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(
+                f"Неизвестный режим кассеты: {mode}. Доступны: {', '.join(CASSETTE_MODES)}"
+            )
+        self.mode = mode
+        self.path = path
+        self.replay_timing = replay_timing
+        self.synthetic_tokens = synthetic_tokens
+        self.synthetic_latency = synthetic_latency
+        self.closed = False
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._records: Dict[str, dict] = {}
+        # Записи дописываются из пула потоков: без блокировки большие
+        # записи параллельных запросов могут перемешаться в файле
+        self._write_lock = threading.Lock()
+        if mode == "replay":
+            self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            raise ValueError(f"Файл кассеты не найден: {self.path}")
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    # Более поздняя запись того же запроса заменяет раннюю
+                    self._records[record["key"]] = record
+        logger.info(f"Загружено {len(self._records)} записей из кассеты {self.path}")
+
+    def _append(self, record: dict):
+        cassette_dir = os.path.dirname(self.path)
+        if cassette_dir:
+            os.makedirs(cassette_dir, exist_ok=True)
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        # gzip допускает несколько склеенных потоков, поэтому можно дописывать
+        with self._write_lock:
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write(line)
+
+    def post(self, url: str, headers: Optional[dict] = None, json: Any = None, **kwargs) -> _CassetteRequest:
+        if self.mode == "record":
+            return _CassetteRequest(self._record("POST", url, headers, json, kwargs))
+        if self.mode == "replay":
+            return _CassetteRequest(self._replay("POST", url, json))
+        return _CassetteRequest(self._synthetic(json))
+
+    async def _record(self, method: str, url: str, headers: Optional[dict], payload: Any, kwargs: dict) -> CassetteResponse:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+        started = time.monotonic()
+        async with self._session.request(method, url, headers=headers, json=payload, **kwargs) as response:
+            body = await response.text()
+            status = response.status
+        record = {
+            "key": make_request_key(method, url, payload),
+            "url": redact_url(url),
+            "request": payload,
+            "status": status,
+            "body": body,
+            "elapsed": round(time.monotonic() - started, 3)
+        }
+        await run_blocking(self._append, record)
+        return CassetteResponse(status, body)
+
+    async def _replay(self, method: str, url: str, payload: Any) -> CassetteResponse:
+        record = self._records.get(make_request_key(method, url, payload))
+        if record is None:
+            raise Exception(f"В кассете {self.path} нет записи для запроса к {redact_url(url)}")
+        if self.replay_timing:
+            await asyncio.sleep(record["elapsed"])
+        return CassetteResponse(record["status"], record["body"])
+
+    async def _synthetic(self, payload: Any) -> CassetteResponse:
+        await asyncio.sleep(self.synthetic_latency)
+        text = " ".join(["текст"] * self.synthetic_tokens)
+        payload = payload or {}
+        json_requested = (
+            (payload.get("response_format") or {}).get("type") == "json_object"
+            or (payload.get("generationConfig") or {}).get("responseMimeType") == "application/json"
+        )
+        if json_requested:
+            # generate_json ждет JSON-объект, а не произвольный текст
+            text = json.dumps({"text": text}, ensure_ascii=False)
+        prompt_tokens = len(json.dumps(payload, ensure_ascii=False).split())
+
+        if "contents" in payload:
+            # Google Gemini
+            data = {
+                "candidates": [{
+                    "content": {"parts": [{"text": text}], "role": "model"},
+                    "finishReason": "STOP"
+                }],
+                "usageMetadata": {
+                    "promptTokenCount": prompt_tokens,
+                    "candidatesTokenCount": self.synthetic_tokens,
+                    "totalTokenCount": prompt_tokens + self.synthetic_tokens
+                }
+            }
+        elif "modelUri" in payload:
+            # YandexGPT
+            data = {
+                "result": {
+                    "alternatives": [{
+                        "message": {"role": "assistant", "text": text},
+                        "status": "ALTERNATIVE_STATUS_FINAL"
+                    }],
+                    "usage": {
+                        "inputTextTokens": str(prompt_tokens),
+                        "completionTokens": str(self.synthetic_tokens),
+                        "totalTokens": str(prompt_tokens + self.synthetic_tokens)
+                    }
+                }
+            }
+        else:
+            # OpenAI-совместимые API (Groq, DeepSeek, OpenAI)
+            data = {
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text},
+                    "finish_reason": "stop"
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": self.synthetic_tokens,
+                    "total_tokens": prompt_tokens + self.synthetic_tokens
+                }
+            }
+        return CassetteResponse(200, json.dumps(data, ensure_ascii=False))
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self.closed = True
+
+
+def create_cassette_session() -> Optional[CassetteSession]:
+    """Создает сессию-кассету по LLM_CASSETTE_MODE (None, если режим не задан)"""
+    mode = os.getenv("LLM_CASSETTE_MODE", "").lower()
+    if not mode:
+        return None
+    return CassetteSession(
+        mode=mode,
+        path=os.getenv("LLM_CASSETTE_PATH", "cassettes/llm.jsonl.gz"),
+        replay_timing=os.getenv("LLM_CASSETTE_REPLAY_TIMING", "false").lower() in ("1", "true", "yes"),
+        synthetic_tokens=int(os.getenv("LLM_SYNTHETIC_TOKENS", "200")),
+        synthetic_latency=float(os.getenv("LLM_SYNTHETIC_LATENCY", "1.0"))
+    )
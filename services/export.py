@@ -0,0 +1,278 @@
+"""
+Выгрузка готовых текстов в файлы DOCX, PDF и Markdown.
+
+Выгружается один готовый текст (КП или описание); пакетной выгрузки нет,
+и список документов целиком передается в пул процессов, поэтому память
+ограничена размером самих текстов. DOCX и Markdown пишутся во временный
+файл абзац за абзацем, не собирая итоговый XML или Markdown в строку;
+PDF reportlab собирает целиком. Отрисовка идет в пуле процессов
+(utils.executors.run_cpu_bound), чтобы не блокировать бота.
+"""
+import logging
+import os
+import re
+import tempfile
+import zipfile
+from html import escape
+from html.parser import HTMLParser
+from typing import IO, Iterable, List, Optional, Tuple
+
+from utils.executors import run_cpu_bound
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = {
+    "docx": "DOCX",
+    "pdf": "PDF",
+    "md": "Markdown"
+}
+
+# Отрезок текста с оформлением: (текст, жирный, курсив, подчеркнутый)
+Run = Tuple[str, bool, bool, bool]
+# Документ для выгрузки: (заголовок, текст в HTML-разметке Telegram)
+Document = Tuple[str, str]
+
+# Управляющие символы, недопустимые в XML (ломают document.xml и разметку PDF)
+_INVALID_XML_RE = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def _clean(text: str) -> str:
+    return _INVALID_XML_RE.sub("", text)
+
+
+class _ParagraphParser(HTMLParser):
+    """Разбивает текст в разметке Telegram на абзацы из отрезков с оформлением"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.paragraphs: List[List[Run]] = [[]]
+        self.bold = 0
+        self.italic = 0
+        self.underline = 0
+
+    def handle_starttag(self, tag, attrs):
+        self._toggle(tag, 1)
+
+    def handle_endtag(self, tag):
+        self._toggle(tag, -1)
+
+    def _toggle(self, tag: str, delta: int):
+        if tag in ("b", "strong"):
+            self.bold = max(0, self.bold + delta)
+        elif tag in ("i", "em"):
+            self.italic = max(0, self.italic + delta)
+        elif tag in ("u", "ins"):
+            self.underline = max(0, self.underline + delta)
+
+    def handle_data(self, data):
+        lines = _clean(data).split("\n")
+        for index, line in enumerate(lines):
+            if index:
+                self.paragraphs.append([])
+            if line:
+                self.paragraphs[-1].append(
+                    (line, self.bold > 0, self.italic > 0, self.underline > 0)
+                )
+
+
+def split_paragraphs(text: str) -> List[List[Run]]:
+    """Непустые абзацы текста с оформлением"""
+    parser = _ParagraphParser()
+    parser.feed(text)
+    parser.close()
+    return [
+        paragraph for paragraph in parser.paragraphs
+        if any(run[0].strip() for run in paragraph)
+    ]
+
+
+# --- Markdown ---
+
+def write_markdown(documents: Iterable[Document], out: IO[str]):
+    for title, text in documents:
+        out.write(f"# {_clean(title)}\n\n")
+        for paragraph in split_paragraphs(text):
+            line = ""
+            for content, bold, italic, _ in paragraph:
+                if bold and content.strip():
+                    content = f"**{content}**"
+                if italic and content.strip():
+                    content = f"_{content}_"
+                line += content
+            line = line.strip()
+            if line.startswith("•"):
+                # Маркеры списков из ответа модели - в синтаксис Markdown
+                line = "-" + line[1:]
+            out.write(line + "\n\n")
+
+
+# --- DOCX ---
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '</Types>'
+)
+
+_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="word/document.xml"/>'
+    '</Relationships>'
+)
+
+_DOCUMENT_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+)
+
+_DOCUMENT_END = (
+    '<w:sectPr><w:pgSz w:w="11906" w:h="16838"/>'
+    '<w:pgMar w:top="1134" w:right="850" w:bottom="1134" w:left="1701" '
+    'w:header="708" w:footer="708" w:gutter="0"/></w:sectPr>'
+    '</w:body></w:document>'
+)
+
+_FONT = '<w:rFonts w:ascii="Calibri" w:hAnsi="Calibri" w:cs="Calibri"/>'
+
+
+def _docx_run(content: str, bold: bool, italic: bool, underline: bool, size: int = 24) -> str:
+    props = _FONT
+    if bold:
+        props += "<w:b/>"
+    if italic:
+        props += "<w:i/>"
+    if underline:
+        props += '<w:u w:val="single"/>'
+    props += f'<w:sz w:val="{size}"/>'
+    return f'<w:r><w:rPr>{props}</w:rPr><w:t xml:space="preserve">{escape(content, quote=False)}</w:t></w:r>'
+
+
+def _docx_paragraph(runs: str, page_break: bool = False) -> str:
+    props = '<w:spacing w:after="160"/>'
+    if page_break:
+        props = "<w:pageBreakBefore/>" + props
+    return f"<w:p><w:pPr>{props}</w:pPr>{runs}</w:p>"
+
+
+def write_docx(documents: Iterable[Document], path: str):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", _CONTENT_TYPES)
+        archive.writestr("_rels/.rels", _RELS)
+        # document.xml пишем потоком, не собирая весь XML в одну строку
+        with archive.open("word/document.xml", "w") as out:
+            out.write(_DOCUMENT_START.encode("utf-8"))
+            for index, (title, text) in enumerate(documents):
+                heading = _docx_run(_clean(title), True, False, False, size=32)
+                out.write(_docx_paragraph(heading, page_break=index > 0).encode("utf-8"))
+                for paragraph in split_paragraphs(text):
+                    runs = "".join(_docx_run(*run) for run in paragraph)
+                    out.write(_docx_paragraph(runs).encode("utf-8"))
+            out.write(_DOCUMENT_END.encode("utf-8"))
+
+
+# --- PDF ---
+
+def _register_pdf_fonts() -> str:
+    """Регистрирует шрифт с кириллицей (стандартные шрифты PDF ее не содержат)"""
+    from reportlab.lib.fonts import addMapping
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    font_dir = os.getenv("EXPORT_FONT_DIR", "/usr/share/fonts/truetype/dejavu")
+    family = "DejaVuSans"
+    if family in pdfmetrics.getRegisteredFontNames():
+        return family
+
+    files = {
+        (0, 0): "DejaVuSans.ttf",
+        (1, 0): "DejaVuSans-Bold.ttf",
+        (0, 1): "DejaVuSans-Oblique.ttf",
+        (1, 1): "DejaVuSans-BoldOblique.ttf"
+    }
+    regular = os.path.join(font_dir, files[(0, 0)])
+    if not os.path.exists(regular):
+        raise Exception(f"Не найден шрифт {regular} для PDF (установите fonts-dejavu)")
+    for (bold, italic), filename in files.items():
+        path = os.path.join(font_dir, filename)
+        name = f"{family}-{bold}{italic}"
+        pdfmetrics.registerFont(TTFont(name, path if os.path.exists(path) else regular))
+        addMapping(family, bold, italic, name)
+    pdfmetrics.registerFont(TTFont(family, regular))
+    return family
+
+
+def write_pdf(documents: Iterable[Document], path: str):
+    try:
+        from reportlab.lib.pagesizes import A4
+        from reportlab.lib.styles import ParagraphStyle
+        from reportlab.lib.units import cm
+        from reportlab.platypus import PageBreak, Paragraph, SimpleDocTemplate
+    except ImportError:
+        raise Exception("Для выгрузки в PDF установите reportlab (pip install reportlab)")
+
+    font = _register_pdf_fonts()
+    body = ParagraphStyle("body", fontName=font, fontSize=11, leading=15, spaceAfter=6)
+    heading = ParagraphStyle("heading", parent=body, fontSize=16, leading=20, spaceAfter=12)
+
+    story = []
+    for index, (title, text) in enumerate(documents):
+        if index:
+            story.append(PageBreak())
+        story.append(Paragraph(f"<b>{escape(_clean(title), quote=False)}</b>", heading))
+        for paragraph in split_paragraphs(text):
+            markup = ""
+            for content, bold, italic, underline in paragraph:
+                content = escape(content, quote=False)
+                if underline:
+                    content = f"<u>{content}</u>"
+                if italic:
+                    content = f"<i>{content}</i>"
+                if bold:
+                    content = f"<b>{content}</b>"
+                markup += content
+            story.append(Paragraph(markup, body))
+
+    SimpleDocTemplate(
+        path, pagesize=A4,
+        leftMargin=2 * cm, rightMargin=2 * cm, topMargin=2 * cm, bottomMargin=2 * cm
+    ).build(story)
+
+
+def render_export(fmt: str, documents: List[Document], path: str) -> str:
+    """Записывает документы в файл нужного формата (выполняется в пуле процессов)"""
+    if fmt == "docx":
+        write_docx(documents, path)
+    elif fmt == "pdf":
+        write_pdf(documents, path)
+    elif fmt == "md":
+        with open(path, "w", encoding="utf-8") as out:
+            write_markdown(documents, out)
+    else:
+        raise ValueError(f"Неподдерживаемый формат выгрузки: {fmt}")
+    return path
+
+
+async def export_documents(fmt: str, documents: List[Document], directory: Optional[str] = None) -> str:
+    """
+    Выгружает документы во временный файл
+
+    Returns:
+        Путь к файлу; удалить его после отправки должен вызывающий
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неподдерживаемый формат выгрузки: {fmt}")
+    directory = directory or os.getenv("EXPORT_DIR") or None
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}", prefix="export-", dir=directory)
+    os.close(fd)
+    try:
+        return await run_cpu_bound(render_export, fmt, documents, path)
+    except BaseException:
+        os.remove(path)
+        raise
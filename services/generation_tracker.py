@@ -0,0 +1,83 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict, Set
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationCancelledError(Exception):
+    """Генерация отменена: пользователь вернулся в меню или начал новую команду"""
+
+
+class GenerationTracker:
+    """
+    Учет выполняющихся генераций по чатам.
+
+    Каждая генерация запускается отдельной задачей, чтобы ее можно было
+    отменить по кнопке "Назад" или новой команде: отмена прерывает и
+    HTTP-запрос к провайдеру, освобождая соединение и не тратя токены.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[int, Set[asyncio.Task]] = {}
+        # Задачи, отмененные через cancel(). Отмену ожидающего обработчика
+        # (остановка диспетчера или воркера) asyncio тоже передает в задачу,
+        # и отличить ее можно только так
+        self._cancelled: Set[asyncio.Task] = set()
+
+    @property
+    def inflight(self) -> int:
+        """Сколько генераций выполняется сейчас во всех чатах"""
+        return sum(len(tasks) for tasks in self._tasks.values())
+
+    async def run(self, chat_id: int, coro: Awaitable[Any]) -> Any:
+        """
+        Выполняет генерацию с возможностью отмены для чата
+
+        Raises:
+            GenerationCancelledError: если генерацию отменили через cancel()
+        """
+        task = asyncio.ensure_future(coro)
+        self._tasks.setdefault(chat_id, set()).add(task)
+        try:
+            return await task
+        except asyncio.CancelledError:
+            current = asyncio.current_task()
+            # Task.cancelling() есть с Python 3.11
+            handler_cancelled = bool(getattr(current, "cancelling", lambda: 0)())
+            if task in self._cancelled and not handler_cancelled:
+                # Отменили саму генерацию (cancel), а не ожидающий ее обработчик
+                raise GenerationCancelledError()
+            task.cancel()
+            raise
+        finally:
+            self._cancelled.discard(task)
+            tasks = self._tasks.get(chat_id)
+            if tasks is not None:
+                tasks.discard(task)
+                if not tasks:
+                    del self._tasks[chat_id]
+
+    def cancel(self, chat_id: int) -> int:
+        """Отменяет все генерации чата, возвращает их количество"""
+        tasks = self._tasks.get(chat_id, set())
+        cancelled = 0
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+                self._cancelled.add(task)
+                cancelled += 1
+        if cancelled:
+            logger.info(f"Отменено генераций в чате {chat_id}: {cancelled}")
+        return cancelled
+
+
+generation_tracker = None  # Инициализируется при первом использовании
+
+
+def get_generation_tracker() -> GenerationTracker:
+    """Получает или создает общий экземпляр GenerationTracker"""
+    global generation_tracker
+    if generation_tracker is None:
+        generation_tracker = GenerationTracker()
+    return generation_tracker
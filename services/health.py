@@ -0,0 +1,220 @@
+"""
+Внутренний HTTP-сервер с проверками здоровья и состоянием процесса.
+
+/health - жив ли процесс (event loop отвечает, polling не завис);
+/ready - готов ли обслуживать пользователей (polling работает, loop не перегружен);
+/stats - метрики в JSON: задержка loop, генерации, очередь отправки,
+    пулы соединений и кэш.
+При HEALTH_DEBUG=true дополнительно доступны /debug/tasks (стеки всех
+asyncio-задач) и /debug/profile?seconds=N (сэмплирующий профиль потока loop).
+"""
+import asyncio
+import io
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+from aiohttp import web
+
+from services import llm_service as llm_module
+from services.cache_service import get_response_cache
+from services.generation_tracker import get_generation_tracker
+from services.sender import get_sender
+from utils.loop_watchdog import LoopLagMonitor
+from utils.middlewares import PollingMonitor
+
+logger = logging.getLogger(__name__)
+
+
+def get_pool_stats(session) -> Optional[dict]:
+    """Заполненность пула соединений aiohttp-сессии (None, если сессии нет)"""
+    connector = getattr(session, "connector", None)
+    if session is None or session.closed or connector is None:
+        return None
+    return {
+        "limit": connector.limit,
+        "in_use": len(getattr(connector, "_acquired", ())),
+        "idle": sum(len(conns) for conns in getattr(connector, "_conns", {}).values())
+    }
+
+
+def sample_stacks(thread_id: int, seconds: float, interval: float = 0.01) -> Counter:
+    """
+    Сэмплирует стек потока раз в interval секунд.
+    Возвращает счетчик свернутых стеков ("модуль:функция;...") для flamegraph.
+    """
+    samples: Counter = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        if stack:
+            samples[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+    return samples
+
+
+class HealthServer:
+    """Внутренний HTTP-сервер проверок здоровья"""
+
+    def __init__(
+        self,
+        polling: PollingMonitor,
+        lag_monitor: Optional[LoopLagMonitor] = None,
+        bot=None,
+        host: str = "127.0.0.1",
+        port: int = 8080,
+        debug: bool = False,
+        poll_stale_seconds: float = 90,
+        max_lag_ms: float = 1000
+    ):
+        self.polling = polling
+        self.lag_monitor = lag_monitor
+        self.bot = bot
+        self.host = host
+        self.port = port
+        self.debug = debug
+        self.poll_stale_seconds = poll_stale_seconds
+        self.max_lag_ms = max_lag_ms
+        self.started = time.monotonic()
+        self._runner: Optional[web.AppRunner] = None
+        self._loop_thread_id: Optional[int] = None
+
+        self.app = web.Application()
+        self.app.router.add_get("/health", self.handle_health)
+        self.app.router.add_get("/ready", self.handle_ready)
+        self.app.router.add_get("/stats", self.handle_stats)
+        if debug:
+            self.app.router.add_get("/debug/tasks", self.handle_tasks)
+            self.app.router.add_get("/debug/profile", self.handle_profile)
+
+    async def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Проверки здоровья доступны на http://{self.host}:{self.port}/health")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def _polling_alive(self) -> bool:
+        since = self.polling.seconds_since_success()
+        if since is None:
+            # Первый getUpdates еще не вернулся: даем время на запуск
+            return time.monotonic() - self.started < self.poll_stale_seconds
+        return since < self.poll_stale_seconds
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        alive = self._polling_alive()
+        return web.json_response(
+            {"status": "ok" if alive else "polling_stalled"},
+            status=200 if alive else 503
+        )
+
+    async def handle_ready(self, request: web.Request) -> web.Response:
+        problems = []
+        if self.polling.seconds_since_success() is None or not self._polling_alive():
+            problems.append("polling")
+        if self.lag_monitor is not None and self.lag_monitor.lag_ms > self.max_lag_ms:
+            problems.append("event_loop_lag")
+        return web.json_response(
+            {"status": "ready" if not problems else "not_ready", "problems": problems},
+            status=200 if not problems else 503
+        )
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.collect_stats())
+
+    def collect_stats(self) -> dict:
+        since = self.polling.seconds_since_success()
+        stats = {
+            "uptime_seconds": round(time.monotonic() - self.started, 1),
+            "polling": {
+                "alive": self._polling_alive(),
+                "seconds_since_success": round(since, 1) if since is not None else None,
+                "last_error": self.polling.last_error
+            },
+            "event_loop": {"tasks": len(asyncio.all_tasks())},
+            "generations": {
+                "active": get_generation_tracker().inflight
+            },
+            "send_queue_depth": get_sender().queue_depth,
+            "connection_pools": {},
+        }
+
+        # Монитор только читаем: запускает его точка входа (LOOP_MONITOR_ENABLED)
+        if self.lag_monitor is not None:
+            stats["event_loop"].update(
+                lag_ms=round(self.lag_monitor.lag_ms, 1),
+                max_lag_ms=round(self.lag_monitor.max_lag_ms, 1),
+                blocks=self.lag_monitor.blocks
+            )
+
+        # Сервис LLM создается лениво: не создаем его ради статистики
+        llm = llm_module.llm_service
+        if llm is not None:
+            stats["generations"]["inflight_by_provider"] = {llm.provider: llm.inflight}
+            stats["connection_pools"]["llm"] = get_pool_stats(llm.session)
+        if self.bot is not None:
+            stats["connection_pools"]["telegram"] = get_pool_stats(
+                getattr(self.bot.session, "_session", None)
+            )
+
+        cache = get_response_cache()
+        stats["cache"] = {
+            "enabled": cache.enabled,
+            "hits": cache.hits,
+            "misses": cache.misses,
+            "hit_ratio": round(cache.hit_ratio(), 3)
+        }
+        return stats
+
+    async def handle_tasks(self, request: web.Request) -> web.Response:
+        out = io.StringIO()
+        tasks = sorted(asyncio.all_tasks(), key=lambda task: task.get_name())
+        out.write(f"Задач: {len(tasks)}\n\n")
+        for task in tasks:
+            task.print_stack(limit=20, file=out)
+            out.write("\n")
+        return web.Response(text=out.getvalue())
+
+    async def handle_profile(self, request: web.Request) -> web.Response:
+        try:
+            seconds = min(float(request.query.get("seconds", "5")), 60.0)
+        except ValueError:
+            return web.Response(status=400, text="seconds должно быть числом")
+        # Сэмплируем поток event loop из другого потока, чтобы не мешать ему
+        samples = await asyncio.to_thread(sample_stacks, self._loop_thread_id, seconds)
+        lines = [f"{stack} {count}" for stack, count in samples.most_common()]
+        return web.Response(text="\n".join(lines) + "\n")
+
+
+def create_health_server(
+    polling: PollingMonitor,
+    lag_monitor: Optional[LoopLagMonitor] = None,
+    bot=None
+) -> Optional[HealthServer]:
+    """Создает сервер проверок здоровья по настройкам окружения (None, если выключен)"""
+    if os.getenv("HEALTH_ENABLED", "true").lower() not in ("1", "true", "yes"):
+        return None
+    return HealthServer(
+        polling=polling,
+        lag_monitor=lag_monitor,
+        bot=bot,
+        host=os.getenv("HEALTH_HOST", "127.0.0.1"),
+        port=int(os.getenv("HEALTH_PORT", "8080")),
+        debug=os.getenv("HEALTH_DEBUG", "false").lower() in ("1", "true", "yes"),
+        poll_stale_seconds=float(os.getenv("HEALTH_POLL_STALE_SECONDS", "90")),
+        max_lag_ms=float(os.getenv("HEALTH_MAX_LAG_MS", "1000"))
+    )
@@ -1,15 +1,35 @@
+import asyncio
+import json
+import logging
 import os
-from typing import Optional
+import time
+from typing import Dict, Optional, Tuple
 import aiohttp
 
+from services.cache_service import get_response_cache
+from services.cassette import create_cassette_session
+from services.usage_service import get_usage_ledger
+from utils.quality import check_response
+from utils.logging_setup import correlation_id, new_llm_correlation_id
+
+logger = logging.getLogger(__name__)
 
 
 class LLMService:
     """Сервис для работы с LLM через различные провайдеры"""
     
+    system_message = (
+        "Ты - профессиональный помощник для владельцев малого бизнеса. "
+        "Твоя задача - создавать качественный коммерческий контент и "
+        "давать практические советы. Будь конкретным, полезным и дружелюбным. "
+        "Отвечай на русском языке."
+    )
+    
     def __init__(self):
         # Определяем провайдера из переменных окружения (по умолчанию groq - бесплатный)
         self.provider = os.getenv("LLM_PROVIDER", "groq").lower()
+        # В режимах кассеты replay/synthetic сеть не нужна, а значит и ключи
+        offline = os.getenv("LLM_CASSETTE_MODE", "").lower() in ("replay", "synthetic")
         
         if self.provider == "groq":
             # Groq AI - БЕСПЛАТНЫЙ, быстрый, рекомендую!
@@ -27,25 +47,48 @@ class LLMService:
             self.model = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
         elif self.provider == "openai":
             self.api_key = os.getenv("OPENAI_API_KEY")
-            if not self.api_key:
+            if not self.api_key and not offline:
                 raise ValueError("OPENAI_API_KEY не найден в переменных окружения!")
             self.base_url = "https://api.openai.com/v1"
             self.model = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
         elif self.provider == "yandex":
             self.api_key = os.getenv("YANDEX_API_KEY")
-            if not self.api_key:
+            if not self.api_key and not offline:
                 raise ValueError("YANDEX_API_KEY не найден в переменных окружения!")
+            # Каталог Yandex Cloud, в котором работает модель (входит в modelUri)
+            self.folder_id = os.getenv("YANDEX_FOLDER_ID", "")
+            if not self.folder_id and not offline:
+                raise ValueError("YANDEX_FOLDER_ID не найден в переменных окружения!")
             self.base_url = "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
             self.model = os.getenv("YANDEX_MODEL", "yandexgpt")
+        elif self.provider == "mock":
+            # Заглушка без сети - для локальной проверки и нагрузочных тестов
+            self.api_key = ""
+            self.base_url = ""
+            self.model = "mock"
+            self.mock_latency = float(os.getenv("MOCK_LATENCY", "0.5"))
         else:
-            raise ValueError(f"Неподдерживаемый провайдер: {self.provider}. Доступны: groq, gemini, deepseek, openai, yandex")
+            raise ValueError(f"Неподдерживаемый провайдер: {self.provider}. Доступны: groq, gemini, deepseek, openai, yandex, mock")
+        
+        if offline and not self.api_key:
+            self.api_key = "offline"
         
         self.session = None
+        # Неизменные части запросов (адрес, заголовки, системная инструкция) по модели
+        self._skeletons: Dict[Tuple[str, str], dict] = {}
+        # Количество запросов к провайдеру, выполняющихся прямо сейчас
+        self.inflight = 0
+        # Общий лимит времени на генерацию (включая повторы и эскалации)
+        self.deadline_seconds = float(os.getenv("LLM_DEADLINE_SECONDS", "60"))
+        # Быстрая/дешевая модель того же провайдера: пробуем ее первой и
+        # переходим на основную, только если ответ не прошел проверку качества
+        self.fast_model = os.getenv("LLM_FAST_MODEL", "")
     
     async def _get_session(self):
         """Получает или создает aiohttp сессию"""
         if self.session is None or self.session.closed:
-            self.session = aiohttp.ClientSession()
+            # Запись/воспроизведение запросов для нагрузочных тестов (LLM_CASSETTE_MODE)
+            self.session = create_cassette_session() or aiohttp.ClientSession()
         return self.session
     
     async def _close_session(self):
@@ -57,7 +100,12 @@ class LLMService:
         self,
         prompt: str,
         max_tokens: int = 2000,
-        temperature: float = 0.7
+        temperature: float = 0.7,
+        user_id: Optional[int] = None,
+        chat_id: Optional[int] = None,
+        content_type: Optional[str] = None,
+        json_mode: bool = False,
+        deadline: Optional[float] = None
     ) -> str:
         """
         Генерирует текст на основе промпта
@@ -66,37 +114,208 @@ class LLMService:
             prompt: Текст промпта
             max_tokens: Максимальное количество токенов в ответе
             temperature: Температура генерации (0.0-1.0)
+            user_id: ID пользователя для учета расхода токенов
+            chat_id: ID чата (тенанта) для учета расхода токенов
+            content_type: Тип контента (post, offer, product, consult_*)
+            json_mode: Просить провайдера вернуть JSON (см. supports_json_output)
+            deadline: Крайний срок по time.monotonic() (см. make_deadline);
+                по умолчанию - LLM_DEADLINE_SECONDS от начала вызова
         
         Returns:
             Сгенерированный текст
         """
-        system_message = (
-            "Ты - профессиональный помощник для владельцев малого бизнеса. "
-            "Твоя задача - создавать качественный коммерческий контент и "
-            "давать практические советы. Будь конкретным, полезным и дружелюбным. "
-            "Отвечай на русском языке."
+        cache = get_response_cache()
+        cache_key = cache.make_key(self.provider, self.model, prompt, max_tokens, temperature)
+        if cache.enabled:
+            cache.note_request(cache_key, prompt, max_tokens, temperature)
+            cached = await cache.aget(cache_key)
+            if cached is not None:
+                return cached
+        
+        get_usage_ledger().check_quota(user_id, chat_id)
+        
+        usage = {"user_id": user_id, "chat_id": chat_id, "content_type": content_type}
+        if deadline is None:
+            # Попытка на быстрой модели и эскалация укладываются в один срок
+            deadline = self.make_deadline()
+        
+        result = None
+        if self.fast_model and self.fast_model != self.model and not json_mode:
+            result = await self._generate_fast(prompt, max_tokens, temperature, usage, deadline)
+        if result is None:
+            result = await self._generate(
+                prompt, max_tokens, temperature, **usage, json_mode=json_mode, deadline=deadline
+            )
+        await cache.aset(cache_key, result["text"])
+        return result["text"]
+    
+    async def _generate_fast(
+        self,
+        prompt: str,
+        max_tokens: int,
+        temperature: float,
+        usage: dict,
+        deadline: float
+    ) -> Optional[dict]:
+        """Генерация на быстрой модели; None, если нужна эскалация на основную"""
+        try:
+            result = await self._generate(
+                prompt, max_tokens, temperature, **usage, deadline=deadline, model=self.fast_model
+            )
+        except Exception as e:
+            logger.warning(f"Быстрая модель {self.fast_model} не ответила: {e}")
+            return None
+        
+        problems = check_response(result["text"], usage["content_type"], result.get("truncated", False))
+        if problems:
+            logger.info(
+                f"Ответ {self.fast_model} не прошел проверку ({'; '.join(problems)}), "
+                f"переход на {self.model}"
+            )
+            return None
+        return result
+    
+    def make_deadline(self) -> float:
+        """Крайний срок для генерации, начинающейся сейчас"""
+        return time.monotonic() + self.deadline_seconds
+    
+    @property
+    def supports_json_output(self) -> bool:
+        """Умеет ли провайдер гарантированно отвечать JSON-объектом"""
+        return self.provider in ("groq", "gemini", "deepseek", "openai")
+    
+    async def generate_json(self, prompt: str, max_tokens: int = 4000, **kwargs) -> dict:
+        """
+        Генерирует ответ в виде JSON-объекта
+        
+        Raises:
+            ValueError: если ответ не удалось разобрать как JSON-объект
+        """
+        text = await self.generate_text(
+            prompt, max_tokens, json_mode=self.supports_json_output, **kwargs
+        )
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Ответ модели не является JSON: {e}")
+        if not isinstance(data, dict):
+            raise ValueError("Ответ модели не является JSON-объектом")
+        return data
+    
+    async def refresh_cached(
+        self,
+        prompt: str,
+        max_tokens: int = 2000,
+        temperature: float = 0.7
+    ) -> int:
+        """
+        Заново генерирует ответ и кладет его в кэш (для фонового прогрева)
+        
+        Returns:
+            Количество потраченных токенов
+        """
+        cache = get_response_cache()
+        result = await self._generate(prompt, max_tokens, temperature, content_type="warmup")
+        await cache.aset(
+            cache.make_key(self.provider, self.model, prompt, max_tokens, temperature),
+            result["text"]
         )
+        return result["prompt_tokens"] + result["completion_tokens"]
+    
+    async def _generate(
+        self,
+        prompt: str,
+        max_tokens: int,
+        temperature: float,
+        user_id: Optional[int] = None,
+        chat_id: Optional[int] = None,
+        content_type: Optional[str] = None,
+        json_mode: bool = False,
+        deadline: Optional[float] = None,
+        model: Optional[str] = None
+    ) -> dict:
+        """Запрос к провайдеру с записью расхода токенов в журнал"""
+        model = model or self.model
+        remaining = (deadline or self.make_deadline()) - time.monotonic()
+        if remaining <= 0:
+            raise Exception("Истекло время ожидания ответа от модели")
         
+        self.inflight += 1
+        started = time.monotonic()
+        cid_token = correlation_id.set(new_llm_correlation_id())
+        try:
+            # По истечении срока wait_for отменяет запрос к провайдеру и закрывает соединение
+            result = await asyncio.wait_for(
+                self._call_provider(prompt, max_tokens, temperature, json_mode, model),
+                timeout=remaining
+            )
+        except asyncio.TimeoutError:
+            raise Exception("Истекло время ожидания ответа от модели")
+        finally:
+            self.inflight -= 1
+            latency_ms = int((time.monotonic() - started) * 1000)
+            logger.info(f"Запрос к {self.provider} ({model}) занял {latency_ms} мс")
+            correlation_id.reset(cid_token)
+        
+        get_usage_ledger().record(
+            provider=self.provider,
+            model=model,
+            prompt_tokens=result["prompt_tokens"],
+            completion_tokens=result["completion_tokens"],
+            latency_ms=latency_ms,
+            user_id=user_id,
+            chat_id=chat_id,
+            content_type=content_type
+        )
+        return result
+    
+    async def _call_provider(
+        self,
+        prompt: str,
+        max_tokens: int,
+        temperature: float,
+        json_mode: bool = False,
+        model: Optional[str] = None
+    ) -> dict:
+        """Вызывает метод генерации выбранного провайдера"""
+        args = (self.system_message, prompt, max_tokens, temperature, json_mode, model)
         if self.provider == "groq":
-            return await self._generate_groq(system_message, prompt, max_tokens, temperature)
+            return await self._generate_groq(*args)
         elif self.provider == "gemini":
-            return await self._generate_gemini(system_message, prompt, max_tokens, temperature)
+            return await self._generate_gemini(*args)
         elif self.provider == "deepseek":
-            return await self._generate_deepseek(system_message, prompt, max_tokens, temperature)
+            return await self._generate_deepseek(*args)
         elif self.provider == "openai":
-            return await self._generate_openai(system_message, prompt, max_tokens, temperature)
+            return await self._generate_openai(*args)
         elif self.provider == "yandex":
-            return await self._generate_yandex(system_message, prompt, max_tokens, temperature)
+            return await self._generate_yandex(*args)
+        elif self.provider == "mock":
+            return await self._generate_mock(*args)
         else:
             raise ValueError(f"Неподдерживаемый провайдер: {self.provider}")
     
+    @staticmethod
+    def _parse_chat_completion(data: dict) -> dict:
+        """Разбирает ответ OpenAI-совместимого API вместе с расходом токенов"""
+        usage = data.get("usage") or {}
+        choice = data["choices"][0]
+        return {
+            "text": choice["message"]["content"].strip(),
+            "prompt_tokens": usage.get("prompt_tokens", 0),
+            "completion_tokens": usage.get("completion_tokens", 0),
+            # finish_reason=length - ответ оборван по max_tokens
+            "truncated": choice.get("finish_reason") == "length"
+        }
+    
     async def _generate_groq(
         self,
         system_message: str,
         prompt: str,
         max_tokens: int,
-        temperature: float
-    ) -> str:
+        temperature: float,
+        json_mode: bool = False,
+        model: Optional[str] = None
+    ) -> dict:
         """Генерация через Groq AI API (БЕСПЛАТНЫЙ!)"""
         if not self.api_key:
             raise ValueError(
@@ -113,7 +332,7 @@ class LLMService:
         }
         
         payload = {
-            "model": self.model,
+            "model": model or self.model,
             "messages": [
                 {"role": "system", "content": system_message},
                 {"role": "user", "content": prompt}
@@ -121,6 +340,8 @@ class LLMService:
             "max_tokens": max_tokens,
             "temperature": temperature
         }
+        if json_mode:
+            payload["response_format"] = {"type": "json_object"}
         
         try:
             async with session.post(url, headers=headers, json=payload) as response:
@@ -129,17 +350,33 @@ class LLMService:
                     raise Exception(f"Groq API ошибка {response.status}: {error_text}")
                 
                 data = await response.json()
-                return data["choices"][0]["message"]["content"].strip()
+                return self._parse_chat_completion(data)
         except Exception as e:
             raise Exception(f"Ошибка при генерации текста через Groq: {str(e)}")
     
+    def _gemini_skeleton(self, model: str, system_message: str) -> dict:
+        """Неизменная часть запроса к Gemini: адрес, заголовки и системная инструкция"""
+        key = (model, system_message)
+        skeleton = self._skeletons.get(key)
+        if skeleton is None:
+            skeleton = self._skeletons[key] = {
+                "url": f"{self.base_url}/models/{model}:generateContent?key={self.api_key}",
+                "headers": {"Content-Type": "application/json"},
+                "payload": {
+                    "systemInstruction": {"parts": [{"text": system_message}]}
+                }
+            }
+        return skeleton
+    
     async def _generate_gemini(
         self,
         system_message: str,
         prompt: str,
         max_tokens: int,
-        temperature: float
-    ) -> str:
+        temperature: float,
+        json_mode: bool = False,
+        model: Optional[str] = None
+    ) -> dict:
         """Генерация через Google Gemini API (БЕСПЛАТНЫЙ!)"""
         if not self.api_key:
             raise ValueError(
@@ -148,45 +385,60 @@ class LLMService:
             )
         
         session = await self._get_session()
-        url = f"{self.base_url}/models/{self.model}:generateContent?key={self.api_key}"
+        skeleton = self._gemini_skeleton(model or self.model, system_message)
         
-        headers = {
-            "Content-Type": "application/json"
+        generation_config = {
+            "temperature": temperature,
+            "maxOutputTokens": max_tokens
         }
-        
-        # Gemini использует другую структуру запроса
-        full_prompt = f"{system_message}\n\n{prompt}"
-        
+        if json_mode:
+            generation_config["responseMimeType"] = "application/json"
+        # Системное сообщение передаем отдельным полем systemInstruction, а не в тексте запроса
         payload = {
-            "contents": [{
-                "parts": [{
-                    "text": full_prompt
-                }]
-            }],
-            "generationConfig": {
-                "temperature": temperature,
-                "maxOutputTokens": max_tokens
-            }
+            **skeleton["payload"],
+            "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+            "generationConfig": generation_config
         }
         
         try:
-            async with session.post(url, headers=headers, json=payload) as response:
+            async with session.post(skeleton["url"], headers=skeleton["headers"], json=payload) as response:
                 if response.status != 200:
                     error_text = await response.text()
                     raise Exception(f"Gemini API ошибка {response.status}: {error_text}")
                 
                 data = await response.json()
-                return data["candidates"][0]["content"]["parts"][0]["text"].strip()
+                return self._parse_gemini_response(data)
         except Exception as e:
             raise Exception(f"Ошибка при генерации текста через Gemini: {str(e)}")
     
+    @staticmethod
+    def _parse_gemini_response(data: dict) -> dict:
+        """Разбирает ответ Gemini вместе с расходом токенов (usageMetadata)"""
+        candidates = data.get("candidates") or []
+        if not candidates or not candidates[0].get("content", {}).get("parts"):
+            # Ответ заблокирован фильтрами или пуст
+            reason = candidates[0].get("finishReason") if candidates else None
+            reason = reason or data.get("promptFeedback", {}).get("blockReason", "нет ответа")
+            raise Exception(f"Gemini не вернул текст: {reason}")
+        
+        candidate = candidates[0]
+        usage = data.get("usageMetadata") or {}
+        return {
+            "text": "".join(part.get("text", "") for part in candidate["content"]["parts"]).strip(),
+            "prompt_tokens": usage.get("promptTokenCount", 0),
+            "completion_tokens": usage.get("candidatesTokenCount", 0),
+            "truncated": candidate.get("finishReason") == "MAX_TOKENS"
+        }
+    
     async def _generate_deepseek(
         self,
         system_message: str,
         prompt: str,
         max_tokens: int,
-        temperature: float
-    ) -> str:
+        temperature: float,
+        json_mode: bool = False,
+        model: Optional[str] = None
+    ) -> dict:
         """Генерация через DeepSeek API"""
         if not self.api_key:
             raise ValueError(
@@ -203,7 +455,7 @@ class LLMService:
         }
         
         payload = {
-            "model": self.model,
+            "model": model or self.model,
             "messages": [
                 {"role": "system", "content": system_message},
                 {"role": "user", "content": prompt}
@@ -211,6 +463,8 @@ class LLMService:
             "max_tokens": max_tokens,
             "temperature": temperature
         }
+        if json_mode:
+            payload["response_format"] = {"type": "json_object"}
         
         try:
             async with session.post(url, headers=headers, json=payload) as response:
@@ -219,7 +473,7 @@ class LLMService:
                     raise Exception(f"DeepSeek API ошибка {response.status}: {error_text}")
                 
                 data = await response.json()
-                return data["choices"][0]["message"]["content"].strip()
+                return self._parse_chat_completion(data)
         except Exception as e:
             raise Exception(f"Ошибка при генерации текста через DeepSeek: {str(e)}")
     
@@ -228,8 +482,10 @@ class LLMService:
         system_message: str,
         prompt: str,
         max_tokens: int,
-        temperature: float
-    ) -> str:
+        temperature: float,
+        json_mode: bool = False,
+        model: Optional[str] = None
+    ) -> dict:
         """Генерация через OpenAI API"""
         session = await self._get_session()
         url = f"{self.base_url}/chat/completions"
@@ -240,7 +496,7 @@ class LLMService:
         }
         
         payload = {
-            "model": self.model,
+            "model": model or self.model,
             "messages": [
                 {"role": "system", "content": system_message},
                 {"role": "user", "content": prompt}
@@ -248,6 +504,8 @@ class LLMService:
             "max_tokens": max_tokens,
             "temperature": temperature
         }
+        if json_mode:
+            payload["response_format"] = {"type": "json_object"}
         
         try:
             async with session.post(url, headers=headers, json=payload) as response:
@@ -256,63 +514,102 @@ class LLMService:
                     raise Exception(f"OpenAI API ошибка {response.status}: {error_text}")
                 
                 data = await response.json()
-                return data["choices"][0]["message"]["content"].strip()
+                return self._parse_chat_completion(data)
         except Exception as e:
             raise Exception(f"Ошибка при генерации текста через OpenAI: {str(e)}")
     
+    def _yandex_skeleton(self, model: str, system_message: str) -> dict:
+        """Неизменная часть запроса к YandexGPT: заголовки, modelUri и системное сообщение"""
+        key = (model, system_message)
+        skeleton = self._skeletons.get(key)
+        if skeleton is None:
+            skeleton = self._skeletons[key] = {
+                "headers": {
+                    "Content-Type": "application/json",
+                    "Authorization": f"Api-Key {self.api_key}",
+                    "x-folder-id": self.folder_id
+                },
+                "model_uri": f"gpt://{self.folder_id}/{model}/latest",
+                "system": {"role": "system", "text": system_message}
+            }
+        return skeleton
+    
     async def _generate_yandex(
         self,
         system_message: str,
         prompt: str,
         max_tokens: int,
-        temperature: float
-    ) -> str:
+        temperature: float,
+        json_mode: bool = False,
+        model: Optional[str] = None
+    ) -> dict:
         """Генерация через YandexGPT API"""
         session = await self._get_session()
-        url = self.base_url
-        
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Api-Key {self.api_key}"
-        }
-        
-        full_prompt = f"{system_message}\n\n{prompt}"
+        skeleton = self._yandex_skeleton(model or self.model, system_message)
         
         payload = {
-            "modelUri": f"gpt://{self.model}/yandexgpt/latest",
+            "modelUri": skeleton["model_uri"],
             "completionOptions": {
                 "stream": False,
                 "temperature": temperature,
                 "maxTokens": str(max_tokens)
             },
             "messages": [
-                {
-                    "role": "system",
-                    "text": system_message
-                },
-                {
-                    "role": "user",
-                    "text": prompt
-                }
+                skeleton["system"],
+                {"role": "user", "text": prompt}
             ]
         }
         
         try:
-            async with session.post(url, headers=headers, json=payload) as response:
+            async with session.post(self.base_url, headers=skeleton["headers"], json=payload) as response:
                 if response.status != 200:
                     error_text = await response.text()
                     raise Exception(f"YandexGPT API ошибка {response.status}: {error_text}")
                 
                 data = await response.json()
-                return data["result"]["alternatives"][0]["message"]["text"].strip()
+                return self._parse_yandex_response(data)
         except Exception as e:
             raise Exception(f"Ошибка при генерации текста через YandexGPT: {str(e)}")
     
+    @staticmethod
+    def _parse_yandex_response(data: dict) -> dict:
+        """Разбирает ответ YandexGPT вместе с расходом токенов (числа приходят строками)"""
+        result = data["result"]
+        alternative = result["alternatives"][0]
+        usage = result.get("usage") or {}
+        return {
+            "text": alternative["message"]["text"].strip(),
+            "prompt_tokens": int(usage.get("inputTextTokens", 0)),
+            "completion_tokens": int(usage.get("completionTokens", 0)),
+            "truncated": alternative.get("status") == "ALTERNATIVE_STATUS_TRUNCATED_FINAL"
+        }
+    
+    async def _generate_mock(
+        self,
+        system_message: str,
+        prompt: str,
+        max_tokens: int,
+        temperature: float,
+        json_mode: bool = False,
+        model: Optional[str] = None
+    ) -> dict:
+        """Генерация-заглушка: отвечает через MOCK_LATENCY секунд без обращения к сети"""
+        await asyncio.sleep(self.mock_latency)
+        text = f"Тестовый ответ на запрос: {prompt[:200]}"
+        if json_mode:
+            text = json.dumps({"text": text}, ensure_ascii=False)
+        return {
+            "text": text,
+            "prompt_tokens": len(system_message.split()) + len(prompt.split()),
+            "completion_tokens": len(text.split())
+        }
+    
     async def generate_with_context(
         self,
         prompt: str,
         context: Optional[str] = None,
-        max_tokens: int = 1000
+        max_tokens: int = 1000,
+        **kwargs
     ) -> str:
         """
         Генерирует текст с дополнительным контекстом
@@ -321,6 +618,7 @@ class LLMService:
             prompt: Основной промпт
             context: Дополнительный контекст
             max_tokens: Максимальное количество токенов
+            **kwargs: Параметры учета расхода (user_id, chat_id, content_type)
         
         Returns:
             Сгенерированный текст
@@ -329,5 +627,15 @@ class LLMService:
         if context:
             full_prompt = f"Контекст: {context}\n\n{prompt}"
         
-        return await self.generate_text(full_prompt, max_tokens)
+        return await self.generate_text(full_prompt, max_tokens, **kwargs)
+
+
+llm_service = None  # Инициализируется при первом использовании
+
 
+def get_llm_service() -> LLMService:
+    """Получает или создает общий экземпляр LLMService"""
+    global llm_service
+    if llm_service is None:
+        llm_service = LLMService()
+    return llm_service
@@ -0,0 +1,385 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import Message
+
+logger = logging.getLogger(__name__)
+
+# Чем меньше число, тем раньше уходит сообщение
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+
+class TokenBucket:
+    """Классический token bucket: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Через сколько секунд будет доступен токен (0 - прямо сейчас)"""
+        self._refill(now)
+        wait = max(0.0, self.paused_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        """Не выдавать токены ближайшие seconds секунд (ответ 429 от Telegram)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+class _SendJob:
+    """Отложенный вызов Bot API в очереди отправки"""
+
+    def __init__(
+        self,
+        chat_id: int,
+        call: Callable[[], Awaitable[Any]],
+        priority: int,
+        future: asyncio.Future,
+        coalesce_key: Optional[Hashable] = None
+    ):
+        self.chat_id = chat_id
+        self.call = call
+        self.priority = priority
+        self.future = future
+        self.coalesce_key = coalesce_key
+        self.retries = 0
+        # Порядковый номер постановки в очередь; сохраняется при повторе после 429,
+        # чтобы повтор не пропустил вперед сообщения, поставленные позже
+        self.seq = 0
+
+    @property
+    def sort_key(self) -> Tuple[int, int]:
+        return self.priority, self.seq
+
+
+class MessageSender:
+    """
+    Очередь исходящих сообщений с учетом лимитов Telegram.
+
+    Соблюдает общий лимит (~30 сообщений в секунду) и лимит на чат
+    (~1 сообщение в секунду), выдерживает паузу retry_after при ответе 429,
+    склеивает частые правки одного и того же сообщения и пропускает
+    интерактивные ответы вперед массовых.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 30,
+        chat_rate: float = 1,
+        chat_burst: float = 3,
+        max_retries: int = 3,
+        idle_seconds: float = 300
+    ):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        # Через сколько секунд без отправок забываем лимит чата
+        self.idle_seconds = idle_seconds
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._last_eviction = time.monotonic()
+        # chat_id -> до какого момента чат на паузе после 429
+        self._flood_until: Dict[int, float] = {}
+        # Очередь каждого чата - куча по (приоритет, порядковый номер)
+        self._chat_queues: Dict[int, List[Tuple[int, int, _SendJob]]] = {}
+        self._queued = 0
+        # Чаты, которым можно отправлять: (приоритет, номер первой задачи чата, chat_id).
+        # Устаревшие записи не удаляются, а пропускаются при извлечении
+        self._ready: List[Tuple[int, int, int]] = []
+        # Чаты, упершиеся в свой лимит: (когда освободится, chat_id)
+        self._waiting: List[Tuple[float, int]] = []
+        self._waiting_chats: set = set()
+        self._counter = itertools.count()
+        self._pending_edits: Dict[Hashable, _SendJob] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        # Ссылки на выполняющиеся вызовы, чтобы задачи не собрал GC
+        self._active: set = set()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queued
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _evict_idle_buckets(self, now: float):
+        """Убирает лимиты чатов, в которые давно ничего не отправляли"""
+        if now - self._last_eviction < self.idle_seconds:
+            return
+        self._last_eviction = now
+        for chat_id, bucket in list(self._chat_buckets.items()):
+            if (
+                chat_id not in self._chat_queues
+                and now - bucket.updated >= self.idle_seconds
+                and bucket.paused_until <= now
+            ):
+                del self._chat_buckets[chat_id]
+        self._flood_until = {
+            chat_id: until for chat_id, until in self._flood_until.items() if until > now
+        }
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    def _push(self, job: _SendJob):
+        chat_queue = self._chat_queues.setdefault(job.chat_id, [])
+        heapq.heappush(chat_queue, (*job.sort_key, job))
+        self._queued += 1
+        self._mark_ready(job.chat_id)
+        self._wakeup.set()
+
+    def _mark_ready(self, chat_id: int):
+        """Ставит первую задачу чата в общую очередь готовых (если чат не ждет лимита)"""
+        chat_queue = self._chat_queues.get(chat_id)
+        if chat_queue and chat_id not in self._waiting_chats:
+            priority, seq, _ = chat_queue[0]
+            heapq.heappush(self._ready, (priority, seq, chat_id))
+
+    def _raise_priority(self, job: _SendJob, priority: int):
+        """Поднимает приоритет задачи, которая уже стоит в очереди"""
+        if priority >= job.priority:
+            return
+        chat_queue = self._chat_queues[job.chat_id]
+        chat_queue[:] = [entry for entry in chat_queue if entry[2] is not job]
+        job.priority = priority
+        chat_queue.append((*job.sort_key, job))
+        heapq.heapify(chat_queue)
+        self._mark_ready(job.chat_id)
+        self._wakeup.set()
+
+    async def send(
+        self,
+        chat_id: int,
+        call: Callable[[], Awaitable[Any]],
+        priority: int = PRIORITY_INTERACTIVE,
+        coalesce_key: Optional[Hashable] = None
+    ) -> Any:
+        """
+        Ставит вызов Bot API в очередь и ждет его результата
+
+        Args:
+            chat_id: Чат, в который уходит сообщение (для лимита на чат)
+            call: Функция, создающая awaitable вызов Bot API
+            priority: PRIORITY_INTERACTIVE или PRIORITY_BULK
+            coalesce_key: Если в очереди уже есть вызов с тем же ключом,
+                он заменяется новым, а оба вызывающих получат один результат
+        """
+        self._ensure_worker()
+
+        if coalesce_key is not None:
+            pending = self._pending_edits.get(coalesce_key)
+            if pending is not None:
+                pending.call = call
+                self._raise_priority(pending, priority)
+                return await asyncio.shield(pending.future)
+
+        job = _SendJob(chat_id, call, priority, asyncio.get_running_loop().create_future(), coalesce_key)
+        job.seq = next(self._counter)
+        if coalesce_key is not None:
+            self._pending_edits[coalesce_key] = job
+        self._push(job)
+        return await asyncio.shield(job.future)
+
+    async def answer(
+        self,
+        message: Message,
+        text: str,
+        priority: int = PRIORITY_INTERACTIVE,
+        **kwargs
+    ) -> Message:
+        """Аналог message.answer через очередь отправки"""
+        return await self.send(
+            message.chat.id,
+            lambda: message.answer(text, **kwargs),
+            priority
+        )
+
+    async def edit_text(
+        self,
+        message: Message,
+        text: str,
+        priority: int = PRIORITY_INTERACTIVE,
+        **kwargs
+    ) -> Any:
+        """Аналог message.edit_text через очередь отправки (со склейкой правок)"""
+        return await self.send(
+            message.chat.id,
+            lambda: message.edit_text(text, **kwargs),
+            priority,
+            coalesce_key=("edit", message.chat.id, message.message_id)
+        )
+
+    async def edit_reply_markup(
+        self,
+        message: Message,
+        priority: int = PRIORITY_INTERACTIVE,
+        **kwargs
+    ) -> Any:
+        """Аналог message.edit_reply_markup через очередь отправки (со склейкой правок)"""
+        return await self.send(
+            message.chat.id,
+            lambda: message.edit_reply_markup(**kwargs),
+            priority,
+            coalesce_key=("markup", message.chat.id, message.message_id)
+        )
+
+    def _next_ready(self, now: float) -> Tuple[Optional[_SendJob], Optional[float]]:
+        """
+        Первая по приоритету задача, чат которой не упирается в лимит.
+        Второе значение - через сколько секунд освободится ближайший чат.
+        """
+        while self._waiting and self._waiting[0][0] <= now:
+            _, chat_id = heapq.heappop(self._waiting)
+            self._waiting_chats.discard(chat_id)
+            self._mark_ready(chat_id)
+
+        while self._ready:
+            priority, seq, chat_id = heapq.heappop(self._ready)
+            chat_queue = self._chat_queues.get(chat_id)
+            if (
+                not chat_queue
+                or chat_id in self._waiting_chats
+                or chat_queue[0][:2] != (priority, seq)
+            ):
+                continue
+            delay = self._chat_bucket(chat_id).delay(now)
+            if delay > 0:
+                heapq.heappush(self._waiting, (now + delay, chat_id))
+                self._waiting_chats.add(chat_id)
+                continue
+            _, _, job = heapq.heappop(chat_queue)
+            self._queued -= 1
+            if chat_queue:
+                self._mark_ready(chat_id)
+            else:
+                del self._chat_queues[chat_id]
+            return job, 0
+
+        if self._waiting:
+            return None, max(0.0, self._waiting[0][0] - now)
+        return None, None
+
+    async def _run(self):
+        while True:
+            self._evict_idle_buckets(time.monotonic())
+            if not self._queued:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            global_delay = self.global_bucket.delay(time.monotonic())
+            if global_delay > 0:
+                await asyncio.sleep(global_delay)
+                continue
+
+            job, delay = self._next_ready(time.monotonic())
+            if job is None:
+                # Все чаты в очереди упираются в лимит: ждем токен или новую задачу
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self.global_bucket.take()
+            self._chat_bucket(job.chat_id).take()
+            if job.coalesce_key is not None:
+                self._pending_edits.pop(job.coalesce_key, None)
+            task = asyncio.create_task(self._execute(job))
+            self._active.add(task)
+            task.add_done_callback(self._active.discard)
+
+    async def _execute(self, job: _SendJob):
+        try:
+            result = await job.call()
+        except TelegramRetryAfter as e:
+            self._chat_bucket(job.chat_id).pause(e.retry_after)
+            now = time.monotonic()
+            self._flood_until = {
+                chat_id: until for chat_id, until in self._flood_until.items() if until > now
+            }
+            self._flood_until[job.chat_id] = now + e.retry_after
+            if len(self._flood_until) > 1:
+                # 429 сразу в нескольких чатах - уперлись в общий лимит бота
+                self.global_bucket.pause(e.retry_after)
+            if job.retries < self.max_retries:
+                job.retries += 1
+                logger.warning(
+                    f"Telegram просит подождать {e.retry_after} с перед отправкой в чат {job.chat_id}"
+                )
+                self._push(job)
+            elif not job.future.done():
+                job.future.set_exception(e)
+        except asyncio.CancelledError:
+            if not job.future.done():
+                job.future.cancel()
+            raise
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+
+    async def close(self):
+        """Останавливает очередь отправки; ожидающие отправки получают ошибку"""
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        for chat_queue in self._chat_queues.values():
+            for _, _, job in chat_queue:
+                if not job.future.done():
+                    job.future.set_exception(Exception("Очередь отправки остановлена"))
+        self._chat_queues.clear()
+        self._queued = 0
+        self._ready.clear()
+        self._waiting.clear()
+        self._waiting_chats.clear()
+        self._pending_edits.clear()
+        for task in list(self._active):
+            task.cancel()
+        if self._active:
+            await asyncio.gather(*self._active, return_exceptions=True)
+
+
+message_sender = None  # Инициализируется при первом использовании
+
+
+def get_sender() -> MessageSender:
+    """Получает или создает общий экземпляр MessageSender"""
+    global message_sender
+    if message_sender is None:
+        message_sender = MessageSender(
+            global_rate=float(os.getenv("TELEGRAM_GLOBAL_RATE", "30")),
+            chat_rate=float(os.getenv("TELEGRAM_CHAT_RATE", "1")),
+            chat_burst=float(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+        )
+    return message_sender
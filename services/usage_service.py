@@ -0,0 +1,271 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from utils.executors import run_blocking
+
+logger = logging.getLogger(__name__)
+
+
+class QuotaExceededError(Exception):
+    """Пользователь или чат исчерпал лимит токенов"""
+
+
+class UsageLedger:
+    """
+    Журнал расхода токенов по пользователям, чатам (тенантам), типам контента
+    и провайдерам.
+
+    Записи копятся в памяти и пачками дописываются в SQLite (таблица только
+    на добавление). Для быстрой проверки квот перед запросом к LLM держим
+    скользящие счетчики в памяти, разбитые на корзины по времени.
+    """
+
+    BUCKETS_PER_WINDOW = 24
+
+    def __init__(
+        self,
+        db_path: str,
+        flush_interval: float = 5.0,
+        flush_batch_size: int = 100,
+        user_token_limit: int = 0,
+        tenant_token_limit: int = 0,
+        window_seconds: int = 86400
+    ):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.flush_batch_size = flush_batch_size
+        # 0 - без ограничений
+        self.user_token_limit = user_token_limit
+        self.tenant_token_limit = tenant_token_limit
+        self.window_seconds = window_seconds
+        self.bucket_seconds = max(1, window_seconds // self.BUCKETS_PER_WINDOW)
+
+        self._buffer: List[Tuple] = []
+        self._flush_lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        # Ссылки на внеочередные записи, чтобы задачи не собрал GC
+        self._flushes: set = set()
+        # id -> [[начало корзины, токены], ...], [сумма по окну]
+        self._user_buckets: Dict[int, Deque[List[int]]] = {}
+        self._user_totals: Dict[int, int] = {}
+        self._tenant_buckets: Dict[int, Deque[List[int]]] = {}
+        self._tenant_totals: Dict[int, int] = {}
+
+        self._init_db()
+        self._load_window()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    def _init_db(self):
+        """Создает файл базы и таблицу журнала"""
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS usage ("
+                "ts REAL NOT NULL, "
+                "user_id INTEGER, "
+                "chat_id INTEGER, "
+                "content_type TEXT, "
+                "provider TEXT NOT NULL, "
+                "model TEXT NOT NULL, "
+                "prompt_tokens INTEGER NOT NULL, "
+                "completion_tokens INTEGER NOT NULL, "
+                "latency_ms INTEGER NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS usage_ts ON usage (ts)")
+        conn.close()
+
+    def _load_window(self):
+        """Восстанавливает скользящие счетчики из базы после перезапуска"""
+        since = time.time() - self.window_seconds
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT user_id, chat_id, CAST(ts / ? AS INTEGER) * ?, "
+                "SUM(prompt_tokens + completion_tokens) "
+                "FROM usage WHERE ts >= ? "
+                "GROUP BY user_id, chat_id, 3 ORDER BY 3",
+                (self.bucket_seconds, self.bucket_seconds, since)
+            ).fetchall()
+        conn.close()
+        for user_id, chat_id, bucket, tokens in rows:
+            self._add_to_counter(self._user_buckets, self._user_totals, user_id, bucket, tokens)
+            self._add_to_counter(self._tenant_buckets, self._tenant_totals, chat_id, bucket, tokens)
+
+    def _add_to_counter(
+        self,
+        buckets: Dict[int, Deque[List[int]]],
+        totals: Dict[int, int],
+        key: Optional[int],
+        bucket: int,
+        tokens: int
+    ):
+        if key is None:
+            return
+        series = buckets.setdefault(key, deque())
+        if series and series[-1][0] == bucket:
+            series[-1][1] += tokens
+        else:
+            series.append([bucket, tokens])
+        totals[key] = totals.get(key, 0) + tokens
+
+    def _window_total(
+        self,
+        buckets: Dict[int, Deque[List[int]]],
+        totals: Dict[int, int],
+        key: Optional[int],
+        now: float
+    ) -> int:
+        """Сумма токенов по ключу за окно, с вытеснением устаревших корзин"""
+        series = buckets.get(key)
+        if not series:
+            return 0
+        oldest = now - self.window_seconds
+        while series and series[0][0] + self.bucket_seconds <= oldest:
+            _, tokens = series.popleft()
+            totals[key] -= tokens
+        if not series:
+            del buckets[key]
+            del totals[key]
+            return 0
+        return totals[key]
+
+    def get_user_usage(self, user_id: int) -> int:
+        """Токены пользователя за текущее окно"""
+        return self._window_total(self._user_buckets, self._user_totals, user_id, time.time())
+
+    def get_tenant_usage(self, chat_id: int) -> int:
+        """Токены чата за текущее окно"""
+        return self._window_total(self._tenant_buckets, self._tenant_totals, chat_id, time.time())
+
+    def check_quota(self, user_id: Optional[int] = None, chat_id: Optional[int] = None):
+        """
+        Проверяет квоты до отправки запроса провайдеру
+
+        Raises:
+            QuotaExceededError: если лимит пользователя или чата исчерпан
+        """
+        now = time.time()
+        if self.user_token_limit and user_id is not None:
+            used = self._window_total(self._user_buckets, self._user_totals, user_id, now)
+            if used >= self.user_token_limit:
+                raise QuotaExceededError(
+                    "Достигнут лимит запросов на сегодня. Попробуйте позже."
+                )
+        if self.tenant_token_limit and chat_id is not None:
+            used = self._window_total(self._tenant_buckets, self._tenant_totals, chat_id, now)
+            if used >= self.tenant_token_limit:
+                raise QuotaExceededError(
+                    "Для этого чата достигнут лимит запросов на сегодня. Попробуйте позже."
+                )
+
+    def record(
+        self,
+        provider: str,
+        model: str,
+        prompt_tokens: int,
+        completion_tokens: int,
+        latency_ms: int,
+        user_id: Optional[int] = None,
+        chat_id: Optional[int] = None,
+        content_type: Optional[str] = None
+    ):
+        """Добавляет запись в журнал и обновляет счетчики квот"""
+        now = time.time()
+        self._buffer.append((
+            now, user_id, chat_id, content_type, provider, model,
+            prompt_tokens, completion_tokens, latency_ms
+        ))
+
+        tokens = prompt_tokens + completion_tokens
+        bucket = int(now // self.bucket_seconds) * self.bucket_seconds
+        self._add_to_counter(self._user_buckets, self._user_totals, user_id, bucket, tokens)
+        self._add_to_counter(self._tenant_buckets, self._tenant_totals, chat_id, bucket, tokens)
+
+        self._ensure_flusher()
+        if len(self._buffer) >= self.flush_batch_size:
+            task = asyncio.get_running_loop().create_task(self.flush())
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    def _ensure_flusher(self):
+        """Запускает фоновую периодическую запись, если она еще не запущена"""
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_periodically())
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def _write_rows(self, rows: List[Tuple]):
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT INTO usage (ts, user_id, chat_id, content_type, provider, model, "
+                "prompt_tokens, completion_tokens, latency_ms) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+        conn.close()
+
+    async def flush(self):
+        """Записывает накопленные записи в SQLite вне event loop"""
+        async with self._flush_lock:
+            if not self._buffer:
+                return
+            rows, self._buffer = self._buffer, []
+            try:
+                await run_blocking(self._write_rows, rows)
+            except Exception as e:
+                # Возвращаем записи в буфер, чтобы не потерять их
+                self._buffer[:0] = rows
+                logger.error(f"Не удалось записать журнал расхода токенов: {e}")
+
+    async def close(self):
+        """Останавливает фоновую запись и сбрасывает остаток буфера"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+        await self.flush()
+
+
+usage_ledger = None  # Инициализируется при первом использовании
+
+
+def _create_usage_ledger() -> UsageLedger:
+    return UsageLedger(
+        db_path=os.getenv("USAGE_DB_PATH", "data/usage.sqlite3"),
+        flush_interval=float(os.getenv("USAGE_FLUSH_INTERVAL", "5")),
+        flush_batch_size=int(os.getenv("USAGE_FLUSH_BATCH", "100")),
+        user_token_limit=int(os.getenv("USAGE_USER_TOKEN_LIMIT", "0")),
+        tenant_token_limit=int(os.getenv("USAGE_TENANT_TOKEN_LIMIT", "0")),
+        window_seconds=int(os.getenv("USAGE_WINDOW_SECONDS", "86400"))
+    )
+
+
+async def init_usage_ledger() -> UsageLedger:
+    """
+    Создает общий журнал при запуске бота: создание базы и чтение
+    счетчиков за окно идут в пуле потоков, а не в event loop
+    """
+    global usage_ledger
+    if usage_ledger is None:
+        usage_ledger = await run_blocking(_create_usage_ledger)
+    return usage_ledger
+
+
+def get_usage_ledger() -> UsageLedger:
+    """Получает общий экземпляр UsageLedger (создает его, если init_usage_ledger не вызывался)"""
+    global usage_ledger
+    if usage_ledger is None:
+        usage_ledger = _create_usage_ledger()
+    return usage_ledger
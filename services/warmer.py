@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import os
+from datetime import date, datetime
+from typing import List, Optional, Tuple
+
+from services.cache_service import ResponseCache, get_response_cache
+from services.llm_service import LLMService, get_llm_service
+from utils.prompts import CONSULT_EXAMPLES, build_consult_prompt
+
+logger = logging.getLogger(__name__)
+
+
+class CacheWarmer:
+    """
+    Фоновый прогрев кэша ответов в часы низкой нагрузки.
+
+    Берет самые частые запросы из статистики кэша (и примеры вопросов из
+    консультаций), заново генерирует те, чьи ответы скоро устареют, и
+    укладывается в суточный бюджет токенов. Пока идут живые запросы
+    пользователей, прогрев ждет.
+
+    Статистика популярности и счетчик живых запросов - в памяти процесса.
+    В supervisor.py прогрев идет только в воркере 0, поэтому он видит
+    популярность и нагрузку лишь своей доли чатов и может работать
+    одновременно с запросами в других воркерах.
+    """
+
+    def __init__(
+        self,
+        llm: LLMService,
+        cache: ResponseCache,
+        hours: Tuple[int, int] = (2, 6),
+        token_budget: int = 50000,
+        top_n: int = 20,
+        min_count: int = 2,
+        refresh_before: int = 6 * 3600,
+        interval: float = 300,
+        pause: float = 5
+    ):
+        self.llm = llm
+        self.cache = cache
+        # Часы прогрева по локальному времени: [начало, конец)
+        self.hours = hours
+        self.token_budget = token_budget
+        self.top_n = top_n
+        self.min_count = min_count
+        self.refresh_before = refresh_before
+        self.interval = interval
+        self.pause = pause
+        self._spent = 0
+        self._budget_day: Optional[date] = None
+
+    def _is_off_peak(self, now: datetime) -> bool:
+        start, end = self.hours
+        if start <= end:
+            return start <= now.hour < end
+        # Интервал через полночь, например 23-5
+        return now.hour >= start or now.hour < end
+
+    def _candidates(self) -> List[dict]:
+        """Популярные запросы и примеры консультаций, которые пора обновить"""
+        requests = self.cache.top_requests(self.top_n, self.min_count)
+        for consult_type, question in CONSULT_EXAMPLES.items():
+            requests.append({
+                "prompt": build_consult_prompt(consult_type, question),
+                "max_tokens": 2000,
+                "temperature": 0.7
+            })
+
+        candidates = []
+        seen = set()
+        for request in requests:
+            key = self.cache.make_key(
+                self.llm.provider, self.llm.model,
+                request["prompt"], request["max_tokens"], request["temperature"]
+            )
+            if key in seen or self.cache.ttl_left(key) > self.refresh_before:
+                continue
+            seen.add(key)
+            candidates.append(request)
+        return candidates
+
+    async def _wait_for_idle(self):
+        """Ждет, пока не останется живых запросов к провайдеру"""
+        while self.llm.inflight > 0:
+            await asyncio.sleep(self.pause)
+
+    async def warm_once(self):
+        """Один проход прогрева в пределах оставшегося бюджета"""
+        today = date.today()
+        if self._budget_day != today:
+            self._budget_day = today
+            self._spent = 0
+
+        for request in self._candidates():
+            if self._spent >= self.token_budget or not self._is_off_peak(datetime.now()):
+                return
+            await self._wait_for_idle()
+            try:
+                self._spent += await self.llm.refresh_cached(
+                    request["prompt"], request["max_tokens"], request["temperature"]
+                )
+            except Exception as e:
+                logger.warning(f"Не удалось прогреть ответ в кэше: {e}")
+            await asyncio.sleep(self.pause)
+
+    async def run(self):
+        """Бесконечный цикл прогрева"""
+        while True:
+            await asyncio.sleep(self.interval)
+            if not self.cache.enabled or not self._is_off_peak(datetime.now()):
+                continue
+            await self.warm_once()
+
+
+def create_cache_warmer() -> Optional[CacheWarmer]:
+    """Создает прогрев по настройкам окружения (None, если он выключен)"""
+    if os.getenv("WARMER_ENABLED", "false").lower() not in ("1", "true", "yes"):
+        return None
+    start, end = os.getenv("WARMER_HOURS", "2-6").split("-")
+    return CacheWarmer(
+        llm=get_llm_service(),
+        cache=get_response_cache(),
+        hours=(int(start), int(end)),
+        token_budget=int(os.getenv("WARMER_TOKEN_BUDGET", "50000")),
+        top_n=int(os.getenv("WARMER_TOP_N", "20"))
+    )
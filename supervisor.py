@@ -0,0 +1,260 @@
+"""
+Многопроцессный запуск бота.
+
+Главный процесс получает обновления от Telegram и раскладывает их по
+воркерам по chat.id, поэтому весь диалог (и его FSM-состояние в памяти)
+всегда обрабатывается одним и тем же процессом. Упавшие воркеры
+перезапускаются с той же очередью обновлений.
+
+Запуск: python supervisor.py [количество воркеров]
+(по умолчанию BOT_WORKERS или число ядер).
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from typing import Deque, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Для воркеров используем spawn: fork после запуска event loop небезопасен
+mp = multiprocessing.get_context("spawn")
+
+
+def get_shard_chat_id(update: dict) -> int:
+    """Определяет чат, к которому относится обновление"""
+    for field in ("message", "edited_message", "channel_post", "edited_channel_post"):
+        if field in update:
+            return update[field]["chat"]["id"]
+    callback = update.get("callback_query")
+    if callback:
+        if callback.get("message"):
+            return callback["message"]["chat"]["id"]
+        return callback["from"]["id"]
+    for field in ("inline_query", "chosen_inline_result", "shipping_query",
+                  "pre_checkout_query", "my_chat_member", "chat_member", "chat_join_request"):
+        if field in update:
+            payload = update[field]
+            if "chat" in payload:
+                return payload["chat"]["id"]
+            return payload["from"]["id"]
+    return 0
+
+
+def get_shard(update: dict, workers: int) -> int:
+    """Номер воркера для обновления"""
+    return hash(get_shard_chat_id(update)) % workers
+
+
+def run_worker(index: int, workers: int, queue):
+    """Точка входа процесса-воркера"""
+    try:
+        asyncio.run(_worker_main(index, workers, queue))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _worker_main(index: int, workers: int, queue):
+    from bot import configure_logging, create_bot
+
+    # Переменные из .env воркер наследует от главного процесса.
+    # У каждого воркера свой файл лога, чтобы процессы не мешали друг другу при ротации
+    os.environ["LOG_FILE"] = f"bot-worker-{index}.log"
+    configure_logging()
+    bot, dp, _ = create_bot()
+
+    # Общий лимит Telegram делим между воркерами (до создания очереди отправки)
+    global_rate = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+    os.environ["TELEGRAM_GLOBAL_RATE"] = str(global_rate / workers)
+    from services.sender import get_sender
+    from services.usage_service import get_usage_ledger, init_usage_ledger
+    from services.warmer import create_cache_warmer
+    from utils.executors import shutdown_executors
+    from utils.loop_watchdog import create_loop_monitor
+
+    loop = asyncio.get_running_loop()
+    # Обработчики выполняются в воркерах - здесь и следим за event loop
+    loop_monitor = create_loop_monitor()
+    if loop_monitor:
+        loop_monitor.start()
+    await init_usage_ledger()
+    # Прогрев кэша достаточно вести в одном воркере (кэш общий через RESPONSE_CACHE_PATH).
+    # Популярность и живую нагрузку он видит только для чатов этого воркера
+    warmer = create_cache_warmer() if index == 0 else None
+    warmer_task = asyncio.create_task(warmer.run()) if warmer else None
+    handling = set()
+
+    logger.info(f"Воркер {index} запущен (pid {os.getpid()})")
+    try:
+        while True:
+            update = await loop.run_in_executor(None, queue.get)
+            if update is None:
+                break
+            task = asyncio.create_task(dp.feed_raw_update(bot, update))
+            handling.add(task)
+            task.add_done_callback(handling.discard)
+        if handling:
+            await asyncio.wait(handling)
+    finally:
+        if warmer_task:
+            warmer_task.cancel()
+        if loop_monitor:
+            loop_monitor.stop()
+        await get_sender().close()
+        await get_usage_ledger().close()
+        shutdown_executors()
+        await bot.session.close()
+        logger.info(f"Воркер {index} остановлен")
+
+
+class Supervisor:
+    """Запускает воркеры, раздает им обновления и следит, чтобы они были живы"""
+
+    def __init__(
+        self,
+        workers: int,
+        check_interval: float = 1.0,
+        restart_delay: float = 1.0,
+        max_restart_delay: float = 60.0,
+        max_restarts: int = 5,
+        restart_window: float = 300.0
+    ):
+        self.workers = workers
+        self.check_interval = check_interval
+        # Пауза перед перезапуском удваивается с каждым падением в окне restart_window
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        # Больше max_restarts падений за restart_window - воркер не поднять, останавливаемся
+        self.max_restarts = max_restarts
+        self.restart_window = restart_window
+        self.queues = [mp.Queue() for _ in range(workers)]
+        self.processes: List[Optional[multiprocessing.process.BaseProcess]] = [None] * workers
+        self._crashes: List[Deque[float]] = [deque() for _ in range(workers)]
+        self._restart_at: List[Optional[float]] = [None] * workers
+
+    def _spawn(self, index: int):
+        process = mp.Process(
+            target=run_worker,
+            args=(index, self.workers, self.queues[index]),
+            name=f"bot-worker-{index}",
+            # Не daemon: воркеру нужен свой пул процессов (run_cpu_bound),
+            # а daemon-процессам запрещено заводить дочерние. Завершает их stop()
+            daemon=False
+        )
+        process.start()
+        self.processes[index] = process
+
+    def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+
+    async def watch(self):
+        """
+        Перезапускает упавшие воркеры с растущей паузой
+
+        Raises:
+            Exception: если воркер падает чаще max_restarts раз за restart_window
+                (например, неверный BOT_TOKEN или ошибка импорта при запуске)
+        """
+        while True:
+            await asyncio.sleep(self.check_interval)
+            now = time.monotonic()
+            for index, process in enumerate(self.processes):
+                if process is None or process.is_alive():
+                    continue
+                restart_at = self._restart_at[index]
+                if restart_at is None:
+                    self._schedule_restart(index, process.exitcode, now)
+                elif now >= restart_at:
+                    self._restart_at[index] = None
+                    self._spawn(index)
+
+    def _schedule_restart(self, index: int, exitcode: Optional[int], now: float):
+        crashes = self._crashes[index]
+        crashes.append(now)
+        while crashes and now - crashes[0] > self.restart_window:
+            crashes.popleft()
+        if len(crashes) > self.max_restarts:
+            raise Exception(
+                f"Воркер {index} упал {len(crashes)} раз за {self.restart_window:.0f} с "
+                f"(последний код {exitcode}), перезапуски прекращены"
+            )
+        delay = min(self.restart_delay * 2 ** (len(crashes) - 1), self.max_restart_delay)
+        logger.error(
+            f"Воркер {index} завершился с кодом {exitcode}, перезапуск через {delay:.0f} с"
+        )
+        self._restart_at[index] = now + delay
+
+    async def poll(self, bot, allowed_updates: List[str], timeout: int = 30):
+        """Long polling с раздачей обновлений по воркерам"""
+        offset = None
+        while True:
+            try:
+                updates = await bot.get_updates(
+                    offset=offset,
+                    timeout=timeout,
+                    allowed_updates=allowed_updates
+                )
+            except Exception as e:
+                logger.error(f"Ошибка при получении обновлений: {e}")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                offset = update.update_id + 1
+                raw = update.model_dump(mode="json", exclude_unset=True, by_alias=True)
+                self.queues[get_shard(raw, self.workers)].put(raw)
+
+    def stop(self, timeout: float = 10):
+        """Просит воркеры доработать текущие обновления и завершиться"""
+        for queue in self.queues:
+            queue.put(None)
+        for process in self.processes:
+            if process is None:
+                continue
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning(f"Воркер {process.name} не завершился за {timeout} с, останавливаю")
+                process.terminate()
+                process.join()
+
+
+async def main(workers: Optional[int] = None):
+    from bot import create_bot
+
+    bot, dp, _ = create_bot()
+    workers = workers or int(os.getenv("BOT_WORKERS", str(os.cpu_count() or 1)))
+    supervisor = Supervisor(
+        workers,
+        max_restarts=int(os.getenv("WORKER_MAX_RESTARTS", "5")),
+        restart_window=float(os.getenv("WORKER_RESTART_WINDOW", "300"))
+    )
+    supervisor.start()
+    logger.info(f"Бот запущен в {workers} процессах и готов к работе!")
+    watcher = asyncio.create_task(supervisor.watch())
+    poller = asyncio.create_task(supervisor.poll(bot, dp.resolve_used_update_types()))
+    try:
+        # poll работает бесконечно, поэтому завершиться может только watch -
+        # с ошибкой, когда воркер не удается поднять
+        done, _ = await asyncio.wait({watcher, poller}, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
+    finally:
+        watcher.cancel()
+        poller.cancel()
+        await bot.session.close()
+        supervisor.stop()
+
+
+if __name__ == "__main__":
+    from bot import configure_logging, load_environment
+
+    load_environment()
+    configure_logging()
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    try:
+        asyncio.run(main(workers))
+    except KeyboardInterrupt:
+        logger.info("Бот остановлен пользователем")
@@ -0,0 +1,66 @@
+"""
+Общие пулы для работы, которая не должна выполняться в event loop.
+
+run_blocking - блокирующий ввод-вывод и библиотеки без async (пул потоков);
+run_cpu_bound - тяжелые вычисления на чистом Python (пул процессов, чтобы
+не держать GIL потока event loop). Функция и аргументы для run_cpu_bound
+должны сериализоваться pickle, то есть функция объявлена на уровне модуля.
+"""
+import asyncio
+import functools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+_thread_pool: Optional[ThreadPoolExecutor] = None
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_thread_pool() -> ThreadPoolExecutor:
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(
+            max_workers=int(os.getenv("BLOCKING_POOL_WORKERS", "8")),
+            thread_name_prefix="blocking"
+        )
+    return _thread_pool
+
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(
+            max_workers=int(os.getenv("CPU_POOL_WORKERS", "2")),
+            # fork после запуска event loop и потоков небезопасен
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _process_pool
+
+
+async def run_blocking(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Выполняет блокирующую функцию в пуле потоков"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_thread_pool(), functools.partial(func, *args, **kwargs))
+
+
+async def run_cpu_bound(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Выполняет тяжелую функцию в пуле процессов"""
+    if multiprocessing.current_process().daemon:
+        # daemon-процессам нельзя заводить дочерние - остаемся в пуле потоков
+        return await run_blocking(func, *args, **kwargs)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_process_pool(), functools.partial(func, *args, **kwargs))
+
+
+def shutdown_executors():
+    """Останавливает пулы (при завершении бота)"""
+    global _thread_pool, _process_pool
+    if _thread_pool is not None:
+        _thread_pool.shutdown(wait=False, cancel_futures=True)
+        _thread_pool = None
+    if _process_pool is not None:
+        # Дожидаемся процессов пула: без этого воркер supervisor.py (сам
+        # дочерний процесс) зависает на выходе, ожидая их завершения
+        _process_pool.shutdown(wait=True, cancel_futures=True)
+        _process_pool = None
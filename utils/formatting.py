@@ -0,0 +1,99 @@
+"""Подготовка ответов модели к отправке в Telegram с parse_mode=HTML"""
+from html import escape
+from html.parser import HTMLParser
+from typing import Dict, List
+
+from utils.executors import run_cpu_bound
+
+# Теги, которые понимает Telegram, и разрешенные атрибуты
+ALLOWED_TAGS = {
+    "b": (), "strong": (), "i": (), "em": (), "u": (), "ins": (),
+    "s": (), "strike": (), "del": (), "tg-spoiler": (), "blockquote": (),
+    "pre": (), "code": ("class",), "a": ("href",), "span": ("class",)
+}
+
+# Короткие тексты дешевле обработать на месте, чем передавать в другой процесс
+OFFLOAD_MIN_CHARS = 20000
+
+
+class _TelegramHTMLSanitizer(HTMLParser):
+    """
+    Оставляет только разрешенные Telegram теги, остальное экранирует как текст.
+    Незакрытые теги закрывает, лишние закрывающие выбрасывает.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.out: List[str] = []
+        self.open_tags: List[str] = []
+        # Разрешенные теги, открытие которых ушло в текст (<span> без tg-spoiler):
+        # тег -> глубины open_tags в момент открытия. Их закрывающие теги тоже
+        # экранируем, а не выбрасываем
+        self.escaped_tags: Dict[str, List[int]] = {}
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "br":
+            self.out.append("\n")
+            return
+        if tag not in ALLOWED_TAGS or (tag == "span" and ("class", "tg-spoiler") not in attrs):
+            # "<Название компании>" и подобное модель пишет как текст, а не разметку
+            self.out.append(escape(self.get_starttag_text() or "", quote=False))
+            if tag in ALLOWED_TAGS:
+                self.escaped_tags.setdefault(tag, []).append(len(self.open_tags))
+            return
+        allowed = ALLOWED_TAGS[tag]
+        rendered = "".join(
+            f' {name}="{escape(value or "")}"' for name, value in attrs if name in allowed
+        )
+        self.out.append(f"<{tag}{rendered}>")
+        self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if tag == "br":
+            self.out.append("\n")
+        else:
+            self.out.append(escape(self.get_starttag_text() or "", quote=False))
+
+    def handle_endtag(self, tag):
+        if tag not in ALLOWED_TAGS:
+            if tag != "br":
+                self.out.append(escape(f"</{tag}>", quote=False))
+            return
+        escaped = self.escaped_tags.get(tag)
+        # Закрывает тот из одноименных тегов, что открыт позже: настоящий или экранированный
+        opened_at = max((i for i, name in enumerate(self.open_tags) if name == tag), default=-1)
+        if escaped and escaped[-1] > opened_at:
+            escaped.pop()
+            self.out.append(escape(f"</{tag}>", quote=False))
+            return
+        if tag not in self.open_tags:
+            return
+        # Закрываем вложенные теги, которые модель забыла закрыть
+        while self.open_tags:
+            current = self.open_tags.pop()
+            self.out.append(f"</{current}>")
+            if current == tag:
+                break
+
+    def handle_data(self, data):
+        self.out.append(escape(data, quote=False))
+
+    def result(self) -> str:
+        self.close()
+        while self.open_tags:
+            self.out.append(f"</{self.open_tags.pop()}>")
+        return "".join(self.out)
+
+
+def sanitize_html(text: str) -> str:
+    """Делает текст модели безопасным для parse_mode=HTML"""
+    parser = _TelegramHTMLSanitizer()
+    parser.feed(text)
+    return parser.result()
+
+
+async def prepare_llm_output(text: str) -> str:
+    """Очищает ответ модели; длинные тексты - в пуле процессов, вне event loop"""
+    if len(text) < OFFLOAD_MIN_CHARS:
+        return sanitize_html(text)
+    return await run_cpu_bound(sanitize_html, text)
@@ -0,0 +1,140 @@
+import hashlib
+import logging
+import os
+import re
+import time
+import unicodedata
+from typing import Dict, Optional, Tuple
+
+from aiogram.types import Message
+
+from services.sender import get_sender
+
+logger = logging.getLogger(__name__)
+
+_SPACES_RE = re.compile(r"[^\S\n]+")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+
+class InvalidInputError(Exception):
+    """Ввод не годится для генерации; текст исключения показывается пользователю"""
+
+
+def normalize_input(text: str) -> str:
+    """
+    Приводит ввод к каноническому виду: NFKC, без невидимых и управляющих
+    символов, с одиночными пробелами и не более чем одной пустой строкой подряд
+    """
+    text = unicodedata.normalize("NFKC", text)
+    # Cf - невидимые символы форматирования (zero-width space, BOM, мягкий перенос),
+    # которые часто приезжают при копировании из редакторов
+    text = "".join(
+        ch for ch in text
+        if ch in "\n\t" or unicodedata.category(ch) not in ("Cc", "Cf")
+    )
+    lines = [_SPACES_RE.sub(" ", line).strip() for line in text.splitlines()]
+    return _BLANK_LINES_RE.sub("\n\n", "\n".join(lines)).strip()
+
+
+def count_meaningful_chars(text: str) -> int:
+    """Количество букв и цифр (эмодзи, пунктуация и пробелы не считаются)"""
+    return sum(1 for ch in text if unicodedata.category(ch)[0] in ("L", "N"))
+
+
+class InputFilter:
+    """
+    Дешевая проверка ввода перед запросом к LLM.
+
+    Отсекает нетекстовые сообщения (стикеры, фото), пустой ввод и ввод из
+    одних эмодзи, обрезает слишком длинный текст и ловит повторную отправку
+    того же текста в течение нескольких секунд, пока первая генерация еще идет.
+    """
+
+    def __init__(
+        self,
+        min_chars: int = 3,
+        max_chars: int = 4000,
+        dedupe_seconds: float = 10.0
+    ):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.dedupe_seconds = dedupe_seconds
+        # chat_id -> (хэш последнего ввода, время)
+        self._recent: Dict[int, Tuple[str, float]] = {}
+
+    def check(self, chat_id: int, text: Optional[str]) -> str:
+        """
+        Возвращает нормализованный текст, готовый для промпта
+
+        Raises:
+            InvalidInputError: если ввод не стоит отправлять в LLM
+        """
+        if text is None:
+            raise InvalidInputError(
+                "✍️ Я понимаю только текст. Опишите задачу словами, пожалуйста."
+            )
+
+        text = normalize_input(text)
+        if count_meaningful_chars(text) < self.min_chars:
+            raise InvalidInputError(
+                "✍️ Слишком короткое описание. Напишите хотя бы пару слов о задаче."
+            )
+
+        if len(text) > self.max_chars:
+            cut = text.rfind(" ", 0, self.max_chars)
+            text = text[:cut if cut > self.max_chars // 2 else self.max_chars].rstrip()
+            logger.info(f"Ввод в чате {chat_id} обрезан до {len(text)} символов")
+
+        self._check_duplicate(chat_id, text)
+        return text
+
+    def _check_duplicate(self, chat_id: int, text: str):
+        now = time.monotonic()
+        digest = hashlib.sha1(text.casefold().encode("utf-8")).hexdigest()
+        previous = self._recent.get(chat_id)
+        if previous and previous[0] == digest and now - previous[1] < self.dedupe_seconds:
+            raise InvalidInputError("⏳ Этот запрос уже принят, ответ скоро придет.")
+        self._recent[chat_id] = (digest, now)
+
+        if len(self._recent) > 10000:
+            self._recent = {
+                chat: entry for chat, entry in self._recent.items()
+                if now - entry[1] < self.dedupe_seconds
+            }
+
+    def forget(self, chat_id: int):
+        """
+        Снимает защиту от повтора, когда генерация по вводу завершилась:
+        после ошибки пользователь должен иметь возможность сразу повторить запрос
+        """
+        self._recent.pop(chat_id, None)
+
+
+input_filter = None  # Инициализируется при первом использовании
+
+
+def get_input_filter() -> InputFilter:
+    """Получает или создает общий экземпляр InputFilter"""
+    global input_filter
+    if input_filter is None:
+        input_filter = InputFilter(
+            min_chars=int(os.getenv("INPUT_MIN_CHARS", "3")),
+            max_chars=int(os.getenv("INPUT_MAX_CHARS", "4000")),
+            dedupe_seconds=float(os.getenv("INPUT_DEDUPE_SECONDS", "10"))
+        )
+    return input_filter
+
+
+async def read_user_input(message: Message) -> Optional[str]:
+    """
+    Проверяет ввод пользователя перед генерацией.
+
+    Возвращает нормализованный текст или None, если пользователю уже
+    отправлен ответ без обращения к LLM (состояние диалога не меняется,
+    можно сразу прислать исправленный текст).
+    """
+    try:
+        return get_input_filter().check(message.chat.id, message.text)
+    except InvalidInputError as e:
+        await get_sender().answer(message, str(e))
+        return None
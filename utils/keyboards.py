@@ -1,5 +1,17 @@
+from typing import Optional
+
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 
+from utils.prompts import PLATFORM_NAMES
+
+PLATFORM_ICONS = {
+    "instagram": "📷",
+    "vk": "🔵",
+    "telegram": "✈️",
+    "facebook": "📘",
+    "ok": "👥"
+}
+
 
 def get_main_keyboard() -> ReplyKeyboardMarkup:
     """Главная клавиатура с основными функциями"""
@@ -57,6 +69,9 @@ def get_platform_keyboard() -> InlineKeyboardMarkup:
             [
                 InlineKeyboardButton(text="👥 Одноклассники", callback_data="platform_ok")
             ],
+            [
+                InlineKeyboardButton(text="🌐 Несколько платформ", callback_data="platforms_multi")
+            ],
             [
                 InlineKeyboardButton(text="🔙 Назад", callback_data="back")
             ]
@@ -65,6 +80,33 @@ def get_platform_keyboard() -> InlineKeyboardMarkup:
     return keyboard
 
 
+def get_multi_platform_keyboard(selected: Optional[list] = None) -> InlineKeyboardMarkup:
+    """Клавиатура для выбора нескольких платформ переключателями"""
+    selected = selected or []
+    buttons = [
+        InlineKeyboardButton(
+            text=f"{'✅' if platform in selected else '⬜'} {PLATFORM_ICONS[platform]} {name}",
+            callback_data=f"toggle_platform_{platform}"
+        )
+        for platform, name in PLATFORM_NAMES.items()
+    ]
+    rows = [buttons[i:i + 2] for i in range(0, len(buttons), 2)]
+    all_selected = len(selected) == len(PLATFORM_NAMES)
+    rows.append([
+        InlineKeyboardButton(
+            text="☑️ Снять все" if all_selected else "🌐 Выбрать все",
+            callback_data="toggle_platform_all"
+        )
+    ])
+    rows.append([
+        InlineKeyboardButton(text="✅ Готово", callback_data="platforms_done")
+    ])
+    rows.append([
+        InlineKeyboardButton(text="🔙 Назад", callback_data="back")
+    ])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
 def get_consultation_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура для выбора типа консультации"""
     keyboard = InlineKeyboardMarkup(
@@ -96,3 +138,16 @@ def get_back_keyboard() -> InlineKeyboardMarkup:
     )
     return keyboard
 
+
+def get_export_keyboard() -> InlineKeyboardMarkup:
+    """Клавиатура для выгрузки готового текста файлом"""
+    keyboard = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(text="📄 DOCX", callback_data="export_docx"),
+                InlineKeyboardButton(text="📕 PDF", callback_data="export_pdf"),
+                InlineKeyboardButton(text="📝 Markdown", callback_data="export_md")
+            ]
+        ]
+    )
+    return keyboard
@@ -0,0 +1,167 @@
+import atexit
+import itertools
+import json
+import logging
+import os
+import queue
+import re
+import sys
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict, List, Optional
+
+# Идентификатор текущего обновления / вызова LLM для связывания строк лога
+correlation_id: ContextVar[str] = ContextVar("correlation_id", default="-")
+
+_llm_call_counter = itertools.count(1)
+
+
+def new_llm_correlation_id() -> str:
+    """Дочерний идентификатор для вызова LLM внутри текущего обновления"""
+    return f"{correlation_id.get()}/llm{next(_llm_call_counter)}"
+
+
+class CorrelationFilter(logging.Filter):
+    """Запоминает correlation id в записи в момент логирования"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.correlation_id = correlation_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Прореживает однотипные сообщения: из одинаковых (с точностью до чисел)
+    сообщений одного логгера за окно пропускает только первые limit.
+    Число отброшенных попадает в поле suppressed следующей пропущенной записи.
+    """
+
+    def __init__(self, limit: int = 20, window: float = 60.0):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        # ключ -> [начало окна, пропущено, отброшено]
+        self._counters: Dict[tuple, List[float]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        # Ошибки не прореживаем
+        if record.levelno >= logging.ERROR:
+            return True
+        message = record.msg if isinstance(record.msg, str) else str(record.msg)
+        key = (record.name, record.levelno, re.sub(r"\d+", "#", message[:200]))
+        now = time.monotonic()
+        counter = self._counters.get(key)
+        if counter is None or now - counter[0] >= self.window:
+            suppressed = int(counter[2]) if counter else 0
+            self._counters[key] = [now, 1, 0]
+            if suppressed:
+                record.suppressed = suppressed
+            if len(self._counters) > 10000:
+                self._counters = {key: self._counters[key]}
+            return True
+        if counter[1] < self.limit:
+            counter[1] += 1
+            return True
+        counter[2] += 1
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "cid": getattr(record, "correlation_id", "-"),
+            "msg": record.getMessage(),
+            "process": record.process
+        }
+        suppressed = getattr(record, "suppressed", None)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """Человекочитаемый формат с correlation id"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s - %(name)s - %(levelname)s - [%(correlation_id)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        if not hasattr(record, "correlation_id"):
+            record.correlation_id = "-"
+        return super().format(record)
+
+
+def setup_logging(
+    level: str = "INFO",
+    log_dir: Optional[str] = "logs",
+    log_file: str = "bot.log",
+    log_format: str = "json",
+    max_bytes: int = 10 * 1024 * 1024,
+    backup_count: int = 5,
+    sample_limit: int = 20,
+    sample_window: float = 60.0
+) -> QueueListener:
+    """
+    Настраивает логирование через очередь.
+
+    В event loop остается только QueueHandler, который кладет запись в
+    очередь; форматирование и запись в stdout и в ротируемый файл идут в
+    отдельном потоке QueueListener.
+    """
+    formatter = JsonFormatter() if log_format == "json" else TextFormatter()
+
+    handlers = []
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(formatter)
+    handlers.append(stream_handler)
+
+    if log_dir:
+        try:
+            os.makedirs(log_dir, exist_ok=True)
+            file_handler = RotatingFileHandler(
+                os.path.join(log_dir, log_file),
+                maxBytes=max_bytes,
+                backupCount=backup_count,
+                encoding="utf-8"
+            )
+            # В файл всегда пишем JSON Lines
+            file_handler.setFormatter(JsonFormatter())
+            handlers.append(file_handler)
+        except OSError as e:
+            print(f"Не удалось открыть файл лога в {log_dir}: {e}", file=sys.stderr)
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(sample_limit, sample_window))
+    queue_handler.addFilter(CorrelationFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    # LOG_LEVEL из .env может быть в любом регистре ("info")
+    level_name = str(level).strip().upper()
+    unknown_level = not isinstance(logging.getLevelName(level_name), int)
+    root.setLevel(logging.INFO if unknown_level else level_name)
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(_stop_listener, listener)
+    if unknown_level:
+        logging.getLogger(__name__).warning(f"Неизвестный уровень логов {level!r}, используется INFO")
+    return listener
+
+
+def _stop_listener(listener: QueueListener):
+    """Дописывает оставшиеся в очереди записи при выходе (если еще не остановлен)"""
+    if listener._thread is not None:
+        listener.stop()
@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Deque, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class LoopLagMonitor:
+    """
+    Измеряет задержку event loop: раз в interval секунд засыпает и смотрит,
+    насколько позже запланированного проснулся. Если обработчики блокируют
+    цикл, опоздание растет у всех задач сразу.
+
+    При block_ms > 0 дополнительно запускается сторожевой поток: если цикл
+    не отзывается дольше block_ms, он снимает стек потока event loop через
+    sys._current_frames() и пишет его в лог - видно, какой код держит цикл,
+    пока блокировка еще идет.
+    """
+
+    def __init__(
+        self,
+        interval: float = 0.5,
+        window: int = 120,
+        warn_ms: float = 500,
+        block_ms: float = 0
+    ):
+        self.interval = interval
+        self.warn_ms = warn_ms
+        self.block_ms = block_ms
+        self.lag_ms = 0.0
+        # Сколько раз сторожевой поток застал цикл заблокированным
+        self.blocks = 0
+        # Последние измерения (при interval=0.5 - примерно за минуту)
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._task: Optional[asyncio.Task] = None
+        self._last_beat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    @property
+    def max_lag_ms(self) -> float:
+        return max(self._samples, default=0.0)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._last_beat = time.monotonic()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        if self.block_ms > 0 and self._watchdog is None:
+            self._loop_thread_id = threading.get_ident()
+            self._stopped.clear()
+            self._watchdog = threading.Thread(
+                target=self._watch, name="loop-watchdog", daemon=True
+            )
+            self._watchdog.start()
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._watchdog is not None:
+            self._stopped.set()
+            self._watchdog = None
+
+    async def _run(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self._last_beat = time.monotonic()
+            self.lag_ms = max(0.0, (self._last_beat - started - self.interval) * 1000)
+            self._samples.append(self.lag_ms)
+            if self.lag_ms >= self.warn_ms:
+                logger.warning(f"Event loop опоздал на {self.lag_ms:.0f} мс")
+
+    def _watch(self):
+        """Сторожевой поток: ловит блокировку цикла, пока она еще длится"""
+        check_interval = min(self.block_ms / 1000 / 2, self.interval)
+        reported = False
+        while not self._stopped.wait(check_interval):
+            blocked_ms = (time.monotonic() - self._last_beat - self.interval) * 1000
+            if blocked_ms < self.block_ms:
+                reported = False
+                continue
+            if reported:
+                continue
+            # Одна запись на блокировку: стек снимаем, пока виновник еще выполняется
+            reported = True
+            self.blocks += 1
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "нет стека"
+            logger.warning(f"Event loop заблокирован более {blocked_ms:.0f} мс:\n{stack}")
+
+
+def create_loop_monitor() -> Optional[LoopLagMonitor]:
+    """
+    Создает монитор event loop по настройкам окружения (None, если выключен).
+    Запускается из точки входа независимо от сервера проверок здоровья.
+    """
+    if os.getenv("LOOP_MONITOR_ENABLED", "true").lower() not in ("1", "true", "yes"):
+        return None
+    # HEALTH_* - прежние имена настроек, когда монитор был частью сервера здоровья
+    return LoopLagMonitor(
+        warn_ms=float(os.getenv("LOOP_LAG_WARN_MS") or os.getenv("HEALTH_LAG_WARN_MS", "500")),
+        block_ms=float(os.getenv("LOOP_BLOCK_WARN_MS") or os.getenv("HEALTH_BLOCK_WARN_MS", "250"))
+    )
@@ -0,0 +1,86 @@
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import GetUpdates, Response, TelegramMethod
+from aiogram.types import Message, TelegramObject, Update
+
+from services.generation_tracker import get_generation_tracker
+from utils.keyboards import get_main_keyboard
+from utils.logging_setup import correlation_id
+
+
+class CorrelationMiddleware(BaseMiddleware):
+    """Проставляет correlation id на время обработки обновления"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        cid = f"u{event.update_id}" if isinstance(event, Update) else "-"
+        token = correlation_id.set(cid)
+        try:
+            return await handler(event, data)
+        finally:
+            correlation_id.reset(token)
+
+
+class CancelGenerationMiddleware(BaseMiddleware):
+    """
+    Отменяет незавершенную генерацию в чате, когда пользователь начинает
+    новую команду (/команда или кнопка главного меню)
+    """
+
+    def __init__(self):
+        self.menu_buttons = {
+            button.text
+            for row in get_main_keyboard().keyboard
+            for button in row
+        }
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        if isinstance(event, Message) and event.text:
+            if event.text.startswith("/") or event.text in self.menu_buttons:
+                get_generation_tracker().cancel(event.chat.id)
+        return await handler(event, data)
+
+
+class PollingMonitor(BaseRequestMiddleware):
+    """
+    Middleware запросов к Bot API: запоминает время последнего успешного
+    getUpdates, чтобы проверка здоровья видела, что polling жив
+    """
+
+    def __init__(self):
+        self.last_success: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def seconds_since_success(self) -> Optional[float]:
+        if self.last_success is None:
+            return None
+        return time.monotonic() - self.last_success
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot: Bot,
+        method: TelegramMethod
+    ) -> Response:
+        if not isinstance(method, GetUpdates):
+            return await make_request(bot, method)
+        try:
+            response = await make_request(bot, method)
+        except Exception as e:
+            self.last_error = str(e)
+            raise
+        self.last_success = time.monotonic()
+        self.last_error = None
+        return response
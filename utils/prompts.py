@@ -0,0 +1,110 @@
+"""Шаблоны промптов для генерации контента и консультаций"""
+
+PLATFORM_NAMES = {
+    "instagram": "Instagram",
+    "vk": "ВКонтакте",
+    "telegram": "Telegram",
+    "facebook": "Facebook",
+    "ok": "Одноклассники"
+}
+
+CONSULT_TYPE_NAMES = {
+    "legal": "Юридические вопросы",
+    "marketing": "Маркетинг",
+    "finance": "Финансы",
+    "other": "Другие вопросы"
+}
+
+CONSULT_CONTEXTS = {
+    "legal": "юридическим вопросам для малого бизнеса в России",
+    "marketing": "маркетингу и продвижению малого бизнеса",
+    "finance": "финансовым вопросам и учету для малого бизнеса",
+    "other": "общим вопросам ведения малого бизнеса"
+}
+
+# Примеры вопросов, которые показываем пользователю при выборе консультации
+CONSULT_EXAMPLES = {
+    "legal": "какие документы нужны для регистрации ИП?",
+    "marketing": "как продвигать бизнес в Instagram?",
+    "finance": "как вести учет доходов и расходов?",
+    "other": "как выбрать нишу для бизнеса?"
+}
+
+
+def build_post_prompt(platform: str, description: str) -> str:
+    """Промпт для поста в соцсети"""
+    return (
+        f"Создай пост для {platform} на основе следующего описания:\n\n"
+        f"{description}\n\n"
+        f"Требования:\n"
+        f"- Адаптируй стиль под {platform}\n"
+        f"- Используй эмодзи уместно\n"
+        f"- Сделай текст привлекательным и вовлекающим\n"
+        f"- Добавь призыв к действию\n"
+        f"- Длина: 1-2 абзаца для {platform}"
+    )
+
+
+def build_multi_post_prompt(platforms: list, description: str) -> str:
+    """Промпт для постов сразу под несколько платформ с ответом в JSON"""
+    keys = ", ".join(f'"{platform}" ({PLATFORM_NAMES.get(platform, platform)})' for platform in platforms)
+    return (
+        f"Создай отдельный пост для каждой из платформ на основе следующего описания:\n\n"
+        f"{description}\n\n"
+        f"Требования:\n"
+        f"- Адаптируй стиль под каждую платформу\n"
+        f"- Используй эмодзи уместно\n"
+        f"- Сделай текст привлекательным и вовлекающим\n"
+        f"- Добавь призыв к действию\n"
+        f"- Длина: 1-2 абзаца для каждой платформы\n\n"
+        f"Верни только JSON-объект, где ключи - идентификаторы платформ: {keys}, "
+        f"а значения - готовые тексты постов."
+    )
+
+
+def build_offer_prompt(description: str) -> str:
+    """Промпт для коммерческого предложения"""
+    return (
+        f"Создай профессиональное коммерческое предложение на основе следующего описания:\n\n"
+        f"{description}\n\n"
+        f"Структура КП:\n"
+        f"1. Приветствие и представление\n"
+        f"2. Описание проблемы клиента\n"
+        f"3. Предложение решения\n"
+        f"4. Преимущества и выгоды\n"
+        f"5. Призыв к действию\n"
+        f"6. Контакты\n\n"
+        f"Стиль: профессиональный, убедительный, но не навязчивый"
+    )
+
+
+def build_product_prompt(description: str) -> str:
+    """Промпт для описания товара/услуги"""
+    return (
+        f"Создай привлекательное описание товара/услуги на основе следующего:\n\n"
+        f"{description}\n\n"
+        f"Требования:\n"
+        f"- Заголовок, привлекающий внимание\n"
+        f"- Структурированное описание с преимуществами\n"
+        f"- Использование маркированных списков\n"
+        f"- Призыв к действию\n"
+        f"- SEO-оптимизация (если применимо)\n"
+        f"- Длина: 150-300 слов"
+    )
+
+
+def build_consult_prompt(consult_type: str, question: str) -> str:
+    """Промпт для ответа на вопрос консультации"""
+    context = CONSULT_CONTEXTS.get(consult_type, "общим вопросам бизнеса")
+    return (
+        f"Ты - эксперт по {context}. "
+        f"Ответь на вопрос владельца малого бизнеса:\n\n"
+        f"{question}\n\n"
+        f"Требования к ответу:\n"
+        f"- Будь конкретным и практичным\n"
+        f"- Приведи примеры, если возможно\n"
+        f"- Структурируй ответ (используй списки, если уместно)\n"
+        f"- Укажи на важные нюансы и подводные камни\n"
+        f"- Если вопрос требует юридической консультации, укажи, что лучше обратиться к юристу\n"
+        f"- Длина: 200-400 слов"
+    )
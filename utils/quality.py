@@ -0,0 +1,71 @@
+"""Быстрые локальные проверки ответа модели (без обращения к LLM)"""
+import re
+from typing import List, Optional, Tuple
+
+# Длина в словах, которую просят промпты из utils/prompts.py.
+# Модели редко попадают точно, поэтому границы проверяем с запасом
+CONTENT_LENGTH_WORDS = {
+    "post": (20, 200),
+    "offer": (120, 700),
+    "product": (150, 300),
+    "consult": (200, 400)
+}
+LENGTH_TOLERANCE = 0.5
+
+# Разделы структуры КП (build_offer_prompt) и слова, по которым их узнаем
+OFFER_SECTIONS = {
+    "проблема клиента": ("проблем", "сложност", "задач", "трудност"),
+    "решение": ("решени", "предлага", "предложени"),
+    "преимущества": ("преимуществ", "выгод", "плюс"),
+    "призыв к действию": ("свяж", "звоните", "пишите", "закаж", "оставьте", "запиш", "обращайтесь"),
+    "контакты": ("контакт", "телефон", "email", "e-mail", "сайт", "@")
+}
+# Сколько разделов КП может не найтись (заголовки модель называет по-своему)
+OFFER_MISSING_ALLOWED = 1
+
+MIN_CYRILLIC_SHARE = 0.6
+
+_WORD_RE = re.compile(r"\w+")
+_LETTER_RE = re.compile(r"[^\W\d_]")
+_CYRILLIC_RE = re.compile(r"[а-яё]", re.IGNORECASE)
+
+
+def get_length_range(content_type: Optional[str]) -> Optional[Tuple[int, int]]:
+    """Допустимая длина ответа в словах для типа контента (consult_* -> consult)"""
+    if not content_type:
+        return None
+    return CONTENT_LENGTH_WORDS.get(content_type.split("_", 1)[0])
+
+
+def check_response(text: str, content_type: Optional[str], truncated: bool = False) -> List[str]:
+    """
+    Проверяет ответ модели
+
+    Returns:
+        Список найденных проблем (пустой, если ответ годится)
+    """
+    problems = []
+    if truncated:
+        problems.append("ответ обрезан по лимиту токенов")
+
+    length_range = get_length_range(content_type)
+    if length_range:
+        words = len(_WORD_RE.findall(text))
+        low, high = length_range
+        if words < low * (1 - LENGTH_TOLERANCE) or words > high * (1 + LENGTH_TOLERANCE):
+            problems.append(f"длина {words} слов вне диапазона {low}-{high}")
+
+    letters = _LETTER_RE.findall(text)
+    if not letters or len(_CYRILLIC_RE.findall(text)) / len(letters) < MIN_CYRILLIC_SHARE:
+        problems.append("ответ не на русском языке")
+
+    if content_type == "offer":
+        lowered = text.lower()
+        missing = [
+            section for section, stems in OFFER_SECTIONS.items()
+            if not any(stem in lowered for stem in stems)
+        ]
+        if len(missing) > OFFER_MISSING_ALLOWED:
+            problems.append(f"нет разделов КП: {', '.join(missing)}")
+
+    return problems